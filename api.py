@@ -0,0 +1,979 @@
+# headless API: the Flask endpoints and the detection pipeline behind them, without the Gradio dashboard
+# or voice capture (see server.py). Whisper, YOLO, Google Vision and OpenAI are imported only by the
+# code that uses them, so `python -m Smart_waste_classification.api` starts without them
+import time
+IMPORT_STARTED = time.perf_counter()
+
+from flask import Flask, request, jsonify
+import hmac
+import math
+import os
+import sys
+import numpy as np
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from queue import Full
+import cv2
+
+from Smart_waste_classification.db import repository, get_user_by_name, create_user, record_disposal
+from Smart_waste_classification.sessions import SessionRegistry, DEFAULT_STATION, station_from_request
+from Smart_waste_classification.archive import CaptureArchive
+from Smart_waste_classification.inference import BatchScheduler, DetectionModel, InferencePool, as_numpy
+from Smart_waste_classification.models import ModelRegistry
+from Smart_waste_classification.identity import IdentityResolver
+from Smart_waste_classification.remote import RemoteService, DirectTransport, HttpTransport
+from Smart_waste_classification.metrics import Histogram, Metrics
+from Smart_waste_classification.led_hub import LedHub, parse_devices
+from Smart_waste_classification.ultrasonic import CLOSE
+from Smart_waste_classification.decode import decode_frame, parse_rois
+from Smart_waste_classification.label_cache import LabelCache, normalize_label
+from Smart_waste_classification.category_table import CATEGORIES, ClassificationUnavailable, load_category_table
+from Smart_waste_classification.jobs import StagedPipeline
+from Smart_waste_classification.disposal_log import DisposalLog
+
+ARCHIVE_AUDIO = os.environ.get("ARCHIVE_AUDIO", "1") != "0"
+
+# frames are decoded straight to about the YOLO input size (0 = full resolution), optionally cropped
+# to the bin opening per station: STATION_ROI="bin1=0.2,0.1,0.8,0.9" (fractions of width/height)
+DECODE_TARGET_SIDE = int(os.environ.get("DECODE_TARGET_SIDE", "640"))
+STATION_ROI = parse_rois(os.environ.get("STATION_ROI"))
+PREVIEW_MAX_SIDE = 640
+PREVIEW_JPEG_QUALITY = 80
+UI_KEEPALIVE = 25
+# per-stage timings, counters and per-session traces, served at /metrics; METRICS=0 turns them off
+METRICS_ENABLED = os.environ.get("METRICS", "1") != "0"
+metrics = Metrics(enabled=METRICS_ENABLED)
+# set ARCHIVE_IMAGES=0 / ARCHIVE_AUDIO=0 to skip saving frames / recordings; a full queue drops captures
+# instead of blocking inference. The archive is trimmed to ARCHIVE_MAX_MB and ARCHIVE_MAX_AGE_DAYS
+ARCHIVE_IMAGES = os.environ.get("ARCHIVE_IMAGES", "1") != "0"
+ARCHIVE_FOLDER = 'captures'
+ARCHIVE_QUEUE_SIZE = 32
+ARCHIVE_MAX_MB = float(os.environ.get("ARCHIVE_MAX_MB", "2048"))
+ARCHIVE_MAX_AGE_DAYS = float(os.environ.get("ARCHIVE_MAX_AGE_DAYS", "30"))
+capture_archive = CaptureArchive(ARCHIVE_FOLDER, max_pending=ARCHIVE_QUEUE_SIZE, max_bytes=int(ARCHIVE_MAX_MB*1024*1024),
+                                 max_age=ARCHIVE_MAX_AGE_DAYS*24*3600, metrics=metrics) if ARCHIVE_IMAGES or ARCHIVE_AUDIO else None
+# every completed disposal is appended to the disposal_events table in batched transactions
+DISPOSAL_LOG_BATCH = int(os.environ.get("DISPOSAL_LOG_BATCH", "64"))
+DISPOSAL_LOG_FLUSH_MS = float(os.environ.get("DISPOSAL_LOG_FLUSH_MS", "500"))
+disposal_log = DisposalLog(repository, batch_size=DISPOSAL_LOG_BATCH, flush_interval=DISPOSAL_LOG_FLUSH_MS/1000, metrics=metrics)
+
+# models load in background threads after startup (or on first use with MODEL_PRELOAD=0)
+MODEL_PRELOAD = os.environ.get("MODEL_PRELOAD", "1") != "0"
+models = ModelRegistry()
+
+YOLO_WEIGHTS = os.environ.get("YOLO_WEIGHTS", "yolov8trained.pt")
+# frames from concurrent /image requests are grouped into one forward pass
+YOLO_MAX_BATCH = int(os.environ.get("YOLO_MAX_BATCH", "8"))
+YOLO_BATCH_WAIT_MS = float(os.environ.get("YOLO_BATCH_WAIT_MS", "20"))
+# SERVING_MODE=production serves the API with waitress on SERVE_THREADS threads and runs YOLO in
+# INFERENCE_WORKERS forked processes sharing the loaded weights; each worker is replaced after
+# INFERENCE_RECYCLE_FRAMES frames and after a weights swap
+SERVING_MODE = os.environ.get("SERVING_MODE", "development")
+SERVE_THREADS = int(os.environ.get("SERVE_THREADS", "16"))
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", "2"))
+INFERENCE_RECYCLE_FRAMES = int(os.environ.get("INFERENCE_RECYCLE_FRAMES", "10000"))
+inference_pool = InferencePool(INFERENCE_WORKERS, max_frames=INFERENCE_RECYCLE_FRAMES, conf=0.5) if SERVING_MODE=="production" else None
+detector = BatchScheduler(lambda: models.get("yolo"), max_batch_size=YOLO_MAX_BATCH, max_wait=YOLO_BATCH_WAIT_MS/1000, metrics=metrics,
+                          runner=inference_pool, concurrency=INFERENCE_WORKERS if inference_pool else 1, conf=0.5)
+
+ESP8266_IP = "10.206.92.156"
+PORT = 81
+WS_URL = f"ws://{ESP8266_IP}:{PORT}/"
+# LED controllers per station, e.g. LED_CONTROLLERS="bin1=ws://10.0.0.5:81/,bin2=ws://10.0.0.6:81/"
+LED_CONTROLLERS = parse_devices(os.environ.get("LED_CONTROLLERS")) or {DEFAULT_STATION: WS_URL}
+
+app = Flask(__name__)
+
+@app.teardown_appcontext
+def release_db_connection(exc):
+    # the development server runs each request on a fresh thread, so the connection goes back to the pool
+    repository.release()
+
+CREDENTIALS_FILE = "/Users/zyp/Documents/CUEE/4764 IOT/project/coastal-glass-437800-e9-c0080f90e4ce.json"
+
+OPENAI_API_KEY = 'your_key_here'
+
+# every OpenAI / Google Vision call goes through a RemoteService: deadline, optional hedge, circuit breaker.
+# REMOTE_STUB_URL points all of them at a local stub server instead (see stubs.py)
+FALLBACK_CATEGORY = "Non-Recyclable Waste"
+REMOTE_STUB_URL = os.environ.get("REMOTE_STUB_URL")
+remote_transport = HttpTransport(REMOTE_STUB_URL) if REMOTE_STUB_URL else DirectTransport(lambda: models.get("vision"), openai_api_key=OPENAI_API_KEY)
+hedge_after = float(os.environ["REMOTE_HEDGE_AFTER"]) if os.environ.get("REMOTE_HEDGE_AFTER") else None
+identity_llm = RemoteService("analyze_identity", "chat", remote_transport, deadline=6.0, hedge_after=hedge_after)
+classify_llm = RemoteService("classify_waste", "chat", remote_transport, deadline=6.0, hedge_after=hedge_after)
+vision_api = RemoteService("google_vision", "vision", remote_transport, deadline=3.0, hedge_after=hedge_after)
+
+# transcripts that match a known user at least this well skip the GPT-4 identity call
+IDENTITY_MATCH_THRESHOLD = 0.75
+identity_resolver = IdentityResolver(repository.list_users())
+repository.user_created_listeners.append(identity_resolver.add)
+
+label_cache = LabelCache()
+
+led_hub = LedHub(LED_CONTROLLERS, metrics=metrics)
+sessions = SessionRegistry()
+
+@metrics.timed("analyze_identity")
+def analyze_identity(transcript):
+    try:
+        print("Analyzing identity from transcript...")
+        prompt = f"""
+The following text is a noisy speech transcription that may contain extra words or slightly corrupted phrases, but it usually includes the person's name and/or user ID.
+Your tasks:
+1. Identify and extract the person's name and/or user ID from the given text.
+2. If the identified name contains non-English letters (e.g., Chinese characters), please transliterate or romanize them into plain English letters.
+3. If you can identify a name, output "Name: [extracted name]"
+4. If you can identify a numeric user ID, output "ID: [extracted number]"
+5. If both found, output both lines
+6. If neither is found, return "Unknown"
+
+Speech content: {transcript}
+        """.strip()
+
+        identity = identity_llm.call({
+            "model": "gpt-4",
+            "messages": [
+                {"role": "system", "content": "You are an identity analysis assistant."},
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": 0.3
+        }, fallback=lambda: "Unknown")
+        print(f"Identified user: {identity}")
+        return identity
+    except Exception as e:
+        print(f"Error in identity analysis: {e}")
+        return "Unknown"
+
+def resolve_identity(transcript):
+    # (identity, confidence); confidence is None when the identity came from GPT-4 rather than a local match
+    match=identity_resolver.resolve(transcript)
+    if match.name is not None and match.confidence>=IDENTITY_MATCH_THRESHOLD:
+        print(f"Matched user locally: {match.name} ({match.confidence:.2f})")
+        metrics.counter("identifications","Users identified, by method.",method="local").inc()
+        return match.as_identity(),match.confidence
+    metrics.counter("identifications","Users identified, by method.",method="llm").inc()
+    raw_identity=analyze_identity(transcript)
+    return process_identity(raw_identity),None
+
+def identify_user(transcript):
+    return resolve_identity(transcript)[0]
+
+def process_identity(identity_result):
+    lines = identity_result.split('\n')
+    recognized_name = None
+    recognized_id = None
+
+    if "Unknown" in identity_result:
+        return "Unknown"
+
+    for line in lines:
+        line = line.strip()
+        if line.lower().startswith("name:"):
+            recognized_name = line.split(":",1)[1].strip().lower()
+        elif line.lower().startswith("id:"):
+            recognized_id_str = line.split(":",1)[1].strip()
+            try:
+                recognized_id = int(recognized_id_str)
+            except:
+                pass
+
+    if recognized_name is None and recognized_id is None:
+        return "Unknown"
+
+    with metrics.stage("db"):
+        user_record = get_user_by_name(recognized_name)
+        if not user_record:
+            if recognized_id is None:
+                recognized_id = 1000 # fallback if no ID provided
+            create_user(recognized_name, recognized_id)
+
+    result_lines = []
+    if recognized_name is not None:
+        result_lines.append(f"Name: {recognized_name}")
+    if recognized_id is not None:
+        result_lines.append(f"ID: {recognized_id}")
+    return "\n".join(result_lines)
+
+def identity_name(identity):
+    for line in (identity or "").split('\n'):
+        if line.lower().startswith("name:"):
+            return line.split(":",1)[1].strip().lower()
+    return None
+
+def load_reminder_items(identity):
+    # the user's reminder set is read once per identification and checked in memory per disposal
+    name=identity_name(identity)
+    if not name:
+        return set()
+    with metrics.stage("db"):
+        user_record=get_user_by_name(name)
+    return user_record["reminder_items"] if user_record else set()
+
+@metrics.timed("classify_waste")
+def classify_waste(items, fallback=True):
+    # fallback=False raises ClassificationUnavailable instead of answering FALLBACK_CATEGORY locally
+    excluded_items = ['finger','fingernail','hand','skin','technology','photograph',
+                      'picture','image','photo','display','screen','snapshot',
+                      'photography','text','font','line','symbol']
+    filtered_items = [item for item in items if item.lower() not in excluded_items]
+
+    labels = {}
+    for item in filtered_items:
+        labels.setdefault(normalize_label(item), item)
+    categories, missing = label_cache.get_many(list(labels))
+
+    if missing:
+        categories.update(request_waste_categories([labels[label] for label in missing],fallback=fallback))
+
+    return [{"item":item,"category":categories[label]} for label,item in labels.items() if label in categories]
+
+def request_waste_categories(items, fallback=True):
+    # one GPT-4 round trip for every label the cache has not seen
+    prompt = f"""You are a waste classification assistant.
+Which category do these items belong to: recyclable waste or non-recyclable waste?
+One item per line "Item - Category".
+If bottles or tissues detected, prioritize them.
+Ignore colors.
+
+{', '.join(items)}"""
+
+    try:
+        response_content = classify_llm.call({
+            "model":"gpt-4",
+            "messages":[
+                {"role":"system","content":"You are a waste classification assistant."},
+                {"role":"user","content":prompt}
+            ],
+            "temperature":0.7
+        }, fallback=lambda: None)
+        if response_content is None:
+            # upstream slow or down: answer locally and leave the cache untouched
+            if not fallback:
+                raise ClassificationUnavailable("GPT-4 unavailable")
+            return {normalize_label(item):FALLBACK_CATEGORY for item in items}
+        categories = {}
+        for line in response_content.split('\n'):
+            if ' - ' in line:
+                item, category = line.split(' - ',1)
+                category=category.strip()
+                if category.lower()=="recyclable waste":
+                    category="Recyclable Waste"
+                else:
+                    category="Non-Recyclable Waste"
+                categories[normalize_label(item)]=category
+        label_cache.put_many(categories)
+        return categories
+    except ClassificationUnavailable:
+        raise
+    except Exception as e:
+        print(f"Error in waste classification: {e}")
+        if not fallback:
+            raise ClassificationUnavailable(str(e))
+        return {}
+
+def load_detection_model(weights=YOLO_WEIGHTS):
+    from ultralytics import YOLO
+    yolo=YOLO(weights)
+    # YOLO's vocabulary is closed, so its labels are classified once here instead of per request
+    category_table=load_category_table(weights,yolo.names,lambda labels:classify_waste(labels,fallback=False))
+    return DetectionModel(weights,yolo,category_table)
+
+def warm_up_detection_model(detection_model):
+    detection_model.yolo(np.zeros((640,640,3),dtype=np.uint8),conf=0.5,verbose=False)
+
+def load_vision_client():
+    from google.cloud import vision
+    from google.oauth2 import service_account
+    credentials=service_account.Credentials.from_service_account_file(CREDENTIALS_FILE)
+    return vision.ImageAnnotatorClient(credentials=credentials)
+
+# with the process pool, warm-up forks and warms the workers, so they are ready before the weights are
+# served, both at start and during a hot swap
+models.register("yolo",load_detection_model,inference_pool.prepare if inference_pool else warm_up_detection_model)
+models.register("vision",load_vision_client)
+
+def analyze_image_with_google_vision(content):
+    print(f"Analyzing image with Google Vision ({len(content)} bytes)")
+    return vision_api.call({"content":content},fallback=list)
+
+# speculative Vision fallback: "off" asks Vision only after YOLO comes back unusable, "parallel" starts it
+# together with YOLO, "delayed" starts it once YOLO has not answered within SPECULATIVE_VISION_DELAY_MS.
+# YOLO results whose top confidence is below SPECULATIVE_MIN_CONFIDENCE count as unusable.
+SPECULATIVE_VISION = os.environ.get("SPECULATIVE_VISION", "off")
+SPECULATIVE_VISION_DELAY_MS = float(os.environ.get("SPECULATIVE_VISION_DELAY_MS", "150"))
+SPECULATIVE_MIN_CONFIDENCE = float(os.environ.get("SPECULATIVE_MIN_CONFIDENCE", "0.5"))
+speculation_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="vision")
+branch_latency = {"yolo": Histogram(), "vision": Histogram()}
+branch_wins = {"yolo": 0, "vision": 0, "low_confidence_yolo": 0, "none": 0}
+
+def timed_branch(branch, future, started):
+    # the callback runs on the worker thread, so the request's trace is captured here
+    trace_id=metrics.current_trace()
+    def record(f):
+        if not f.cancelled() and f.exception() is None:
+            seconds=time.perf_counter()-started
+            branch_latency[branch].observe(seconds)
+            metrics.observe(branch,seconds,trace_id)
+    future.add_done_callback(record)
+    return future
+
+def start_vision(image, image_bytes):
+    if image_bytes is None:
+        image_bytes=cv2.imencode('.jpg',image)[1].tobytes()
+    return timed_branch("vision",speculation_pool.submit(analyze_image_with_google_vision,image_bytes),time.perf_counter())
+
+def yolo_usable(result):
+    return result is not None and len(result.boxes)>0 and float(result.boxes.conf.max())>=SPECULATIVE_MIN_CONFIDENCE
+
+def run_detection(image, image_bytes):
+    # returns (detection_model, yolo_result, vision_labels); whichever usable answer arrives first wins
+    yolo_future=timed_branch("yolo",detector.submit(image),time.perf_counter())
+    vision_future=None
+    if SPECULATIVE_VISION=="parallel":
+        vision_future=start_vision(image,image_bytes)
+    elif SPECULATIVE_VISION=="delayed":
+        done,_=wait([yolo_future],timeout=SPECULATIVE_VISION_DELAY_MS/1000)
+        if not done:
+            vision_future=start_vision(image,image_bytes)
+
+    if vision_future is not None:
+        done,_=wait([yolo_future,vision_future],return_when=FIRST_COMPLETED)
+        if yolo_future not in done and vision_future.result():
+            yolo_future.cancel()
+            branch_wins["vision"]+=1
+            return None,None,vision_future.result()
+
+    detection_model,result=yolo_future.result()
+    if yolo_usable(result):
+        if vision_future is not None:
+            vision_future.cancel()
+        branch_wins["yolo"]+=1
+        return detection_model,result,None
+
+    vision_labels=(vision_future or start_vision(image,image_bytes)).result()
+    if vision_labels:
+        branch_wins["vision"]+=1
+        return detection_model,None,vision_labels
+    branch_wins["low_confidence_yolo" if result is not None and len(result.boxes)>0 else "none"]+=1
+    return detection_model,result,None
+
+def build_analysis(detection_model, result, vision_labels):
+    # what the frame shows and how it is classified; nothing here depends on the user at the bin,
+    # so the result can be reused for a near-identical frame
+    detections = result.boxes if result is not None else []
+
+    if detections and len(detections)>0:
+        # YOLO success
+        names=detection_model.names
+        class_ids=as_numpy(detections.cls).astype(np.intp)
+        confidences=as_numpy(detections.conf)
+        boxes=as_numpy(detections.xyxy).astype(int)
+        category_ids=detection_model.category_table[class_ids]
+
+        items=[names[class_id] for class_id in class_ids]
+        labelled_boxes=[(x1,y1,x2,y2,f"{names[class_id]} {confidence:.2f}")
+                        for class_id,confidence,(x1,y1,x2,y2) in zip(class_ids,confidences,boxes)]
+        classifications=[]
+        for class_id,category_id in dict(zip(class_ids.tolist(),category_ids.tolist())).items():
+            classifications.append({"item":names[class_id],"category":CATEGORIES[category_id]})
+
+        best_index=int(confidences.argmax())
+        return {"source":"yolo",
+                "detection_text":"YOLO detection results:\n"+ "\n".join(items),
+                "classifications":classifications,
+                "best_item_name":names[int(class_ids[best_index])],
+                "best_item_class":CATEGORIES[category_ids[best_index]],
+                "boxes":labelled_boxes,
+                "captions":[]}
+
+    if vision_labels:
+        # YOLO no result, use Vision
+        best_label=max(vision_labels, key=lambda l:l['score'])
+        best_item_name=best_label['description']
+        classifications=classify_waste([l['description'] for l in vision_labels])
+        best_item_class=None
+        for c in classifications:
+            if c['item'].lower().replace(" ","_")==best_item_name.lower().replace(" ","_"):
+                best_item_class=c['category']
+                break
+        if not best_item_class:
+            best_item_class="Non-Recyclable Waste"
+        captions=[f"{l['description']}: {l['score']}%" for l in vision_labels]
+        return {"source":"vision",
+                "detection_text":"Google Vision Detection Results:\n"+ "\n".join(captions),
+                "classifications":classifications,
+                "best_item_name":best_item_name,
+                "best_item_class":best_item_class,
+                "boxes":[],
+                "captions":captions}
+
+    return {"source":"none",
+            "detection_text":"No object detected",
+            "classifications":None,
+            "best_item_name":"unknown_object",
+            "best_item_class":"Non-Recyclable Waste",
+            "boxes":[],
+            "captions":[]}
+
+def analyze_frame(image, image_bytes):
+    return build_analysis(*run_detection(image,image_bytes))
+
+def draw_analysis(image, analysis):
+    annotated_image=image.copy()
+    for x1,y1,x2,y2,label in analysis["boxes"]:
+        cv2.rectangle(annotated_image,(x1,y1),(x2,y2),(0,255,0),2)
+        cv2.putText(annotated_image,label,(x1,y1-10),cv2.FONT_HERSHEY_SIMPLEX,0.8,(0,255,0),2)
+    y_position=30
+    for caption in analysis["captions"]:
+        cv2.putText(annotated_image,caption,(10,y_position),cv2.FONT_HERSHEY_SIMPLEX,0.7,(0,255,0),2)
+        y_position+=30
+    return annotated_image
+
+def process_image(session, image, image_bytes=None):
+    try:
+        analysis=analyze_frame(image,image_bytes)
+        return apply_analysis(session,image,image_bytes,analysis)
+    except Exception as e:
+        print(f"Error processing image: {str(e)}")
+        return {'status':'error','message':str(e)}
+
+def apply_analysis(session, image, image_bytes, analysis):
+    # the per-user part: reminder warning, LED status, session state and archiving
+    try:
+        if ARCHIVE_IMAGES and capture_archive is not None:
+            capture_archive.submit("frame",image_bytes if image_bytes is not None else image,"jpg",
+                                   session=session.trace_id,station=session.station_id,label=analysis["best_item_name"])
+        metrics.counter("images","Frames processed, by the source of the answer.",source=analysis["source"]).inc()
+        best_item_name=analysis["best_item_name"]
+        best_item_class=analysis["best_item_class"]
+
+        session.last_image=image
+        session.last_result=draw_analysis(image,analysis)
+        session.last_text=analysis["detection_text"]
+
+        msg_to_send=f"{best_item_name}:{best_item_class}"
+        if analysis["classifications"] is None:
+            session.last_waste_text="No waste classification results"
+        else:
+            warning_message=""
+            if best_item_name.lower() in session.reminder_items:
+                warning_message=f"warning: {best_item_name}: please note it is {best_item_class}"
+
+            waste_text_lines=["Waste Classification Results:"]
+            for c in analysis["classifications"]:
+                waste_text_lines.append(f"{c['item']} - {c['category']}")
+            if warning_message:
+                waste_text_lines.append(warning_message)
+                msg_to_send+=";warning"
+            session.last_waste_text="\n".join(waste_text_lines)
+        led_hub.send(session.station_id,msg_to_send)
+
+        session.last_item_disposed=best_item_name
+        session.last_item_class=best_item_class
+        session.has_received_image=True
+        session.waiting_for_close_event=True
+        session.publish(previews=(encode_preview(session.last_image),encode_preview(session.last_result)))
+
+        return {'status':'success','message':'Image processed and best item info sent.'}
+
+    except Exception as e:
+        print(f"Error processing image: {str(e)}")
+        return {'status':'error','message':str(e)}
+
+# with ASYNC_IMAGES=1 (or ?mode=async) /image answers 202 with a job ID as soon as the frame is decoded,
+# and the rest runs as detect -> classify -> notify stages with bounded queues; poll /jobs/<id> for the result
+ASYNC_IMAGES = os.environ.get("ASYNC_IMAGES", "0") != "0"
+IMAGE_QUEUE_SIZE = int(os.environ.get("IMAGE_QUEUE_SIZE", "16"))
+
+def detect_stage(job):
+    payload=job.payload
+    with metrics.trace(payload["trace_id"]):
+        payload["detection"]=run_detection(payload["image"],payload["image_bytes"])
+
+def classify_stage(job):
+    payload=job.payload
+    with metrics.trace(payload["trace_id"]):
+        payload["analysis"]=build_analysis(*payload.pop("detection"))
+
+def notify_stage(job):
+    payload=job.payload
+    session=sessions.get(job.key)
+    with session.lock:
+        if session.pending_job is not job:
+            # the station was restarted while this frame was in flight
+            return {'status':'stale','message':'Session ended before the frame was processed'}
+        with metrics.trace(payload["trace_id"]):
+            result=apply_analysis(session,payload["image"],payload["image_bytes"],payload["analysis"])
+        if result['status']!='success':
+            raise RuntimeError(result['message'])
+        session.pending_job=None
+    return dict(result,item=session.last_item_disposed,category=session.last_item_class)
+
+def release_image_job(job):
+    # a failed frame frees the session so the camera can send another one
+    session=sessions.get(job.key)
+    with session.lock:
+        if session.pending_job is job:
+            session.pending_job=None
+            session.has_received_image=False
+    metrics.counter("image_jobs","Asynchronous /image jobs, by outcome.",outcome=job.state).inc()
+
+# detect gets enough workers to fill a YOLO batch; a full downstream stage holds up the one before it
+image_pipeline=StagedPipeline([("detect",detect_stage,YOLO_MAX_BATCH),("classify",classify_stage,4),("notify",notify_stage,2)],
+                              queue_size=IMAGE_QUEUE_SIZE,on_finish=release_image_job)
+
+def complete_disposal(session, status):
+    # called with session.lock held once the item has gone into bin `status` (1 recyclable, 2 non-recyclable)
+    user_identity=session.user_identity
+    user_id_num=None
+    user_name=None
+    user_score_display="invalid"
+    user_str="user_unknown"
+
+    if user_identity and user_identity!="Unknown":
+        for line in user_identity.split('\n'):
+            if line.lower().startswith("id:"):
+                line_id=line.split(':',1)[1].strip()
+                try:
+                    user_id_num=int(line_id)
+                except:
+                    pass
+            if line.lower().startswith("name:"):
+                user_name=line.split(":",1)[1].strip().lower()
+
+    if session.last_item_class is None:
+        correct="incorrect"
+    else:
+        if status==1:
+            correct="correct" if session.last_item_class.lower()=="recyclable waste" else "incorrect"
+        elif status==2:
+            correct="correct" if session.last_item_class.lower()=="non-recyclable waste" else "incorrect"
+        else:
+            correct="incorrect"
+
+    user_record=None
+    if user_name:
+        # score, complete_times and reminders are updated in one transaction
+        with metrics.stage("db"):
+            user_record=record_disposal(user_name,correct=="correct",session.last_item_disposed)
+    metrics.counter("disposals","Completed disposals, by whether the right bin was used.",result=correct).inc()
+    disposal_log.append(session.station_id,correct=="correct",user_name=user_name if user_record else None,
+                        item=session.last_item_disposed,category=session.last_item_class,bin=status,session=session.trace_id)
+
+    if user_record:
+        session.reminder_items=user_record["reminder_items"]
+        user_score_display=str(round(user_record["score"],3))
+        user_str=f"user{user_record['id']} name_{user_record['name']}"
+    else:
+        # unknown user
+        # first disposal unknown user means invalid score
+        # no database update
+        user_score_display="invalid"
+
+    user_msg=f"{user_str} disposal_{correct} current_score_{user_score_display}"
+    led_hub.send(session.station_id,user_msg)
+
+    if session.last_waste_text is None:
+        session.last_waste_text=""
+    session.last_waste_text+=f"\nDisposal: {correct}\nScore: {user_score_display}"
+
+    session.is_running=False
+    session.waiting_for_close_event=False
+
+@app.route('/distance', methods=['POST'])
+def receive_distance():
+    try:
+        session=sessions.get(station_from_request(request))
+        data=request.get_json(force=True)
+        status=data.get("status",None)
+        if status is not None:
+            with session.lock:
+                changed=status!=session.last_close_status
+                session.last_close_status=status
+                if session.waiting_for_close_event and (status==1 or status==2):
+                    with metrics.trace(session.trace_id):
+                        complete_disposal(session,status)
+                    changed=True
+
+                if changed:
+                    session.publish()
+
+            return jsonify({'status':'success','message':'Status data received'}),200
+        else:
+            return jsonify({'status':'error','message':'Invalid data'}),400
+    except Exception as e:
+        print(f"Error processing distance data: {str(e)}")
+        return jsonify({'status':'error','message':str(e)}),500
+
+def invalid_distance_sample(sample):
+    # returns why a /distance/batch sample is malformed, or None
+    if not isinstance(sample,dict):
+        return "not an object"
+    status=sample.get("status")
+    if status is not None and (isinstance(status,bool) or status not in (0,1,2)):
+        return "status must be 0, 1 or 2"
+    ts=sample.get("ts")
+    if ts is not None and (isinstance(ts,bool) or not isinstance(ts,(int,float)) or not math.isfinite(ts)):
+        return "ts must be a number"
+    station=sample.get("station")
+    if station is not None and not isinstance(station,str):
+        return "station must be a string"
+    return None
+
+@app.route('/distance/batch', methods=['POST'])
+def receive_distance_batch():
+    # body: {"samples": [{"station": "bin1", "status": 1, "ts": 1718000000.5}, ...]}
+    # station defaults to ?station= / X-Station-Id, ts to the time of receipt
+    try:
+        data=request.get_json(force=True)
+        samples=data.get("samples") if isinstance(data,dict) else None
+        if not isinstance(samples,list):
+            return jsonify({'status':'error','message':'Invalid data'}),400
+        default_station=station_from_request(request)
+        now=time.time()
+        by_station={}
+        # the whole batch is checked before any sample reaches a station's state machine
+        for index,sample in enumerate(samples):
+            error=invalid_distance_sample(sample)
+            if error:
+                return jsonify({'status':'error','message':f'Invalid sample {index}: {error}'}),400
+        for sample in samples:
+            if sample.get("status") is None:
+                continue
+            by_station.setdefault(sample.get("station") or default_station,[]).append((sample.get("ts",now),sample["status"]))
+
+        counts={'accepted':0,'transitions':0,'close_events':0}
+        for station_id,station_samples in by_station.items():
+            session=sessions.get(station_id)
+            station_samples.sort(key=lambda s:s[0])
+            for ts,status in station_samples:
+                counts['accepted']+=1
+                event=session.sensor.feed(status,ts)
+                if event is None:
+                    continue
+                counts['transitions']+=1
+                with session.lock:
+                    session.last_close_status=status
+                    if event==CLOSE:
+                        counts['close_events']+=1
+                        if session.waiting_for_close_event:
+                            with metrics.trace(session.trace_id):
+                                complete_disposal(session,status)
+                    session.publish()
+        return jsonify({'status':'success',**counts}),200
+    except Exception as e:
+        print(f"Error processing distance batch: {str(e)}")
+        return jsonify({'status':'error','message':str(e)}),500
+
+@app.route('/image',methods=['POST'])
+def receive_image():
+    session=sessions.find(station_from_request(request))
+    if session is None:
+        return jsonify({'status':'error','message':'System not running'}),403
+    run_async=request.args.get("mode",default="async" if ASYNC_IMAGES else "sync")=="async"
+    with session.lock:
+        if not session.is_running:
+            return jsonify({'status':'error','message':'System not running'}),403
+
+        if not session.user_identity or session.user_identity=="Unknown":
+            return jsonify({'status':'error','message':"User identity not recognized yet."}),403
+
+        # in async mode a newer frame replaces one that is still waiting for detection
+        superseded=session.pending_job if run_async else None
+        if session.has_received_image and superseded is None:
+            return jsonify({'status':'error','message':'Image already received and processed for this session'}),403
+
+        print(f"Receiving image from ESP32-CAM at station {session.station_id}...")
+        image_data=request.data
+        with metrics.trace(session.trace_id):
+            # archiving and the Vision fallback use the original bytes, so no full-resolution frame is kept
+            with metrics.stage("decode"):
+                image=decode_frame(image_data,DECODE_TARGET_SIDE,STATION_ROI.get(session.station_id))
+
+            if image is None:
+                return jsonify({'status':'error','message':"Invalid image format"}),400
+
+            if run_async:
+                return enqueue_image(session,image,image_data,superseded)
+            result=process_image(session,image,image_data)
+    return jsonify(result)
+
+def enqueue_image(session, image, image_data, superseded):
+    # called with session.lock held
+    if superseded is not None:
+        if not image_pipeline.drop(superseded):
+            return jsonify({'status':'error','message':'Image already received and processed for this session'}),403
+        session.pending_job=None
+        metrics.counter("image_jobs","Asynchronous /image jobs, by outcome.",outcome="superseded").inc()
+    job=image_pipeline.submit(session.station_id,{"image":image,"image_bytes":image_data,"trace_id":session.trace_id})
+    if job is None:
+        session.has_received_image=False
+        return jsonify({'status':'error','message':'Server busy, try again'}),503,{'Retry-After':'1'}
+    session.pending_job=job
+    session.has_received_image=True
+    return jsonify({'status':'accepted','job_id':job.id,'status_url':f'/jobs/{job.id}'}),202,{'Location':f'/jobs/{job.id}'}
+
+@app.route('/jobs/<job_id>',methods=['GET'])
+def job_status(job_id):
+    job=image_pipeline.get(job_id)
+    if job is None:
+        return jsonify({'status':'error','message':'Unknown job'}),404
+    return jsonify(job.describe())
+
+@app.route('/stats/jobs',methods=['GET'])
+def job_stats():
+    return jsonify(image_pipeline.stats())
+
+@app.route('/test',methods=['GET'])
+def test():
+    return 'Server is running!',200
+
+@app.route('/stats/inference',methods=['GET'])
+def inference_stats():
+    stats=detector.stats()
+    if inference_pool is not None:
+        stats['pool']=inference_pool.stats()
+    return jsonify(stats)
+
+@app.route('/ready',methods=['GET'])
+def ready():
+    status=models.status()
+    return jsonify(status),(200 if models.is_ready() else 503)
+
+@app.route('/stats/models',methods=['GET'])
+def model_stats():
+    return jsonify(models.status())
+
+# a .pt file is a pickle, so loading one runs code: swaps only accept .pt files inside WEIGHTS_DIR, from
+# callers presenting ADMIN_TOKEN (X-Admin-Token header), or from localhost when no token is configured
+WEIGHTS_DIR = os.path.realpath(os.environ.get("WEIGHTS_DIR", "weights"))
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+def is_admin_request(req):
+    if ADMIN_TOKEN:
+        return hmac.compare_digest(req.headers.get("X-Admin-Token",""),ADMIN_TOKEN)
+    return req.remote_addr in ("127.0.0.1","::1")
+
+def resolve_weights(name):
+    # returns the real path of a .pt file inside WEIGHTS_DIR, or None
+    if not isinstance(name,str) or not name.endswith(".pt"):
+        return None
+    path=os.path.realpath(os.path.join(WEIGHTS_DIR,name))
+    if os.path.commonpath([path,WEIGHTS_DIR])!=WEIGHTS_DIR or not os.path.isfile(path):
+        return None
+    return path
+
+@app.route('/models/yolo',methods=['POST'])
+def swap_yolo_weights():
+    # body: {"weights": "new.pt"}, relative to WEIGHTS_DIR; the current weights keep serving until the new
+    # ones are warmed up
+    if not is_admin_request(request):
+        return jsonify({'status':'error','message':'Forbidden'}),403
+    data=request.get_json(force=True) or {}
+    weights=resolve_weights(data.get("weights"))
+    if weights is None:
+        return jsonify({'status':'error','message':f'Weights must be an existing .pt file in {WEIGHTS_DIR}'}),400
+    threading.Thread(target=swap_detection_model,args=(weights,),daemon=True).start()
+    return jsonify({'status':'accepted','message':f'Loading {weights}'}),202
+
+def swap_detection_model(weights):
+    try:
+        models.swap("yolo",lambda: load_detection_model(weights))
+    except Exception as e:
+        print(f"Error swapping YOLO weights to {weights}: {e}")
+
+@app.route('/stats/remote',methods=['GET'])
+def remote_stats():
+    return jsonify({s.name:s.stats() for s in (identity_llm,classify_llm,vision_api)})
+
+@app.route('/stats/speculative',methods=['GET'])
+def speculative_stats():
+    return jsonify({'mode':SPECULATIVE_VISION,'delay_ms':SPECULATIVE_VISION_DELAY_MS,
+                    'min_confidence':SPECULATIVE_MIN_CONFIDENCE,'wins':branch_wins,
+                    'latency':{branch:h.snapshot() for branch,h in branch_latency.items()}})
+
+@app.route('/stats/leds',methods=['GET'])
+def led_stats():
+    return jsonify(led_hub.stats())
+
+@app.route('/metrics',methods=['GET'])
+def prometheus_metrics():
+    return metrics.render(),200,{'Content-Type':'text/plain; version=0.0.4'}
+
+@app.route('/traces/<trace_id>',methods=['GET'])
+def trace_spans(trace_id):
+    # stage timings recorded for one disposal session (trace IDs are shown in /state)
+    spans=metrics.spans(trace_id)
+    if not spans:
+        return jsonify({'status':'error','message':'Unknown trace'}),404
+    return jsonify({'trace_id':trace_id,'spans':spans})
+
+@app.route('/stats/archive',methods=['GET'])
+def archive_stats():
+    return jsonify(capture_archive.stats() if capture_archive is not None else {'enabled':False})
+
+@app.route('/archive',methods=['GET'])
+def archive_index():
+    # ?session=<trace id>&station=&label=&since=<unix time>&limit=
+    if capture_archive is None:
+        return jsonify({'status':'error','message':'Archive disabled'}),404
+    try:
+        rows=capture_archive.find(session=request.args.get("session"),station=request.args.get("station"),
+                                  label=request.args.get("label"),since=request.args.get("since",type=float),
+                                  limit=min(request.args.get("limit",default=100,type=int),1000))
+    except (Full,TimeoutError):
+        # the write queue is full, or the archive thread did not answer in time
+        return jsonify({'status':'error','message':'Archive busy'}),503,{'Retry-After':'1'}
+    return jsonify({'captures':rows})
+
+@app.route('/stats/disposal_log',methods=['GET'])
+def disposal_log_stats():
+    return jsonify(disposal_log.stats())
+
+@app.route('/leaderboard',methods=['GET'])
+def leaderboard():
+    # ?limit=&min_disposals=
+    return jsonify({'users':repository.leaderboard(limit=min(request.args.get("limit",default=10,type=int),1000),
+                                                   min_disposals=request.args.get("min_disposals",default=1,type=int))})
+
+@app.route('/stats/items',methods=['GET'])
+def item_stats():
+    # ?limit=&min_disposals=; items ordered by how often they go in the wrong bin
+    return jsonify({'items':repository.item_error_rates(limit=min(request.args.get("limit",default=20,type=int),1000),
+                                                        min_disposals=request.args.get("min_disposals",default=1,type=int))})
+
+@app.route('/stats/stations',methods=['GET'])
+def station_stats():
+    # ?station=&since=<unix time>&limit=; disposals per station and hour
+    return jsonify({'hours':repository.station_volume(station=request.args.get("station"),since=request.args.get("since",type=float),
+                                                      limit=min(request.args.get("limit",default=168,type=int),10000))})
+
+@app.route('/stats/label_cache',methods=['GET'])
+def label_cache_stats():
+    return jsonify(label_cache.stats())
+
+def start_detection(station_id=DEFAULT_STATION):
+    session=sessions.get(station_id)
+    with session.lock:
+        session.is_running=True
+        session.trace_id=metrics.new_trace()
+        session.user_identity=None
+        session.reminder_items=set()
+        session.reset()
+    session.publish(previews=(None,None))
+    return None,None,f"System started at station {session.station_id}. Please start recording to identify the user ID...","",""
+
+def describe_session(session):
+    user_id_display=f"User Identity: {session.user_identity if session.user_identity else 'Not recognized'}"
+
+    if session.last_close_status is not None:
+        close_text=f"Ultrasonic status: {'Object detected close' if session.last_close_status in [1,2] else 'No close object detected'}"
+    else:
+        close_text="No ultrasonic data"
+
+    if session.last_image is None:
+        return f"{user_id_display}\nWaiting for ESP32-CAM image...\n{close_text}",""
+
+    return f"{user_id_display}\n\n{session.last_text}\n\n{close_text}", session.last_waste_text
+
+def encode_preview(image):
+    # downscaled JPEG encoded once per image, instead of sending full-resolution arrays to every viewer
+    if image is None:
+        return None
+    h,w=image.shape[:2]
+    scale=PREVIEW_MAX_SIDE/max(h,w)
+    if scale<1:
+        image=cv2.resize(image,(int(w*scale),int(h*scale)),interpolation=cv2.INTER_AREA)
+    ok,buf=cv2.imencode('.jpg',image,[cv2.IMWRITE_JPEG_QUALITY,PREVIEW_JPEG_QUALITY])
+    return buf.tobytes() if ok else None
+
+@app.route('/state',methods=['GET'])
+def state_long_poll():
+    # returns as soon as the station's version differs from ?since=, or after ?timeout= seconds
+    session=sessions.find(station_from_request(request))
+    if session is None:
+        return jsonify({'status':'error','message':'Unknown station'}),404
+    since=request.args.get("since",type=int)
+    timeout=min(request.args.get("timeout",default=UI_KEEPALIVE,type=float),UI_KEEPALIVE)
+    version=session.wait_for_change(since,timeout)
+    detection_text,waste_text=describe_session(session)
+    return jsonify({'station':session.station_id,'trace_id':session.trace_id,'version':version,'image_version':session.image_version,
+                    'detection_text':detection_text,'waste_text':waste_text})
+
+@app.route('/state/image/<kind>',methods=['GET'])
+def state_image(kind):
+    session=sessions.find(station_from_request(request))
+    if session is None:
+        return jsonify({'status':'error','message':'Unknown station'}),404
+    if kind not in ('input','result'):
+        return jsonify({'status':'error','message':'Unknown image kind'}),404
+    etag=str(session.image_version)
+    if request.if_none_match.contains(etag):
+        return '',304
+    jpeg=session.preview_jpegs[0 if kind=='input' else 1]
+    if jpeg is None:
+        return jsonify({'status':'error','message':'No image yet'}),404
+    return jpeg,200,{'Content-Type':'image/jpeg','ETag':f'"{etag}"'}
+
+def cleanup():
+    led_hub.close()
+    image_pipeline.close()
+    detector.close()
+    if inference_pool is not None:
+        inference_pool.close()
+    if capture_archive is not None:
+        capture_archive.close()
+    disposal_log.close()
+
+def run_flask():
+    if SERVING_MODE=="production":
+        from waitress import serve
+        print(f"Serving the API with waitress ({SERVE_THREADS} threads, {INFERENCE_WORKERS} inference workers)")
+        serve(app,host='0.0.0.0',port=12345,threads=SERVE_THREADS)
+    else:
+        app.run(host='0.0.0.0',port=12345,debug=False,use_reloader=False)
+
+@app.route('/session/start',methods=['POST'])
+def start_session():
+    # headless counterpart of the dashboard's "Start System" button
+    session=sessions.get(station_from_request(request))
+    start_detection(session.station_id)
+    return jsonify({'status':'success','station':session.station_id,'trace_id':session.trace_id})
+
+@app.route('/session/identity',methods=['POST'])
+def set_session_identity():
+    # body: {"transcript": "..."} from a separate voice front end; resolved as after Whisper
+    session=sessions.find(station_from_request(request))
+    data=request.get_json(force=True) or {}
+    transcript=(data.get("transcript") or "").strip()
+    if session is None or not session.is_running:
+        return jsonify({'status':'error','message':'System not running'}),403
+    if not transcript:
+        return jsonify({'status':'error','message':'Invalid data'}),400
+    with metrics.trace(session.trace_id):
+        identity=identify_user(transcript)
+        session.user_identity=identity
+        session.reminder_items=load_reminder_items(identity)
+    session.has_received_image=False
+    session.publish()
+    return jsonify({'status':'success','identity':identity})
+
+# modules whose import cost the headless API is meant to avoid
+HEAVY_MODULES = ("gradio", "sounddevice", "soundfile", "whisper", "ultralytics", "torch", "google.cloud.vision", "openai")
+IMPORT_SECONDS = {"api": time.perf_counter()-IMPORT_STARTED}
+
+@app.route('/stats/startup',methods=['GET'])
+def startup_stats():
+    return jsonify({'import_seconds':{k:round(v,3) for k,v in IMPORT_SECONDS.items()},
+                    'heavy_modules_loaded':[m for m in HEAVY_MODULES if m in sys.modules]})
+
+def main():
+    import atexit
+    atexit.register(cleanup)
+    print(f"Headless API imported in {IMPORT_SECONDS['api']:.2f}s")
+    if MODEL_PRELOAD:
+        models.start()
+    run_flask()
+
+if __name__=="__main__":
+    main()
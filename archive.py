@@ -0,0 +1,229 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from queue import Queue, Full, Empty
+
+import cv2
+
+class CaptureArchive:
+    # content-addressed store for captured frames and recordings: each distinct payload is written once to
+    # <root>/<aa>/<bb>/<sha256>.<ext>, and index.db records which session, station and label it belongs to.
+    # Writes, eviction and compaction all run on one background thread fed by a bounded queue.
+    def __init__(self, root, max_pending=32, max_bytes=2 * 1024**3, max_age=30 * 24 * 3600,
+                 compact_interval=600, metrics=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.compact_interval = compact_interval
+        self.metrics = metrics
+        self.queue = Queue(maxsize=max_pending)
+        self.written = 0
+        self.deduplicated = 0
+        self.dropped = 0
+        self.evicted = 0
+        self.total_bytes = 0
+        self.last_compaction = None
+        os.makedirs(root, exist_ok=True)
+        self._conn = None
+        self.thread = threading.Thread(target=self._worker, daemon=True, name="capture-archive")
+        self.thread.start()
+
+    def submit(self, kind, data, ext, session=None, station=None, label=None):
+        # data is either encoded bytes (stored as-is) or a BGR ndarray (encoded here, off the request path)
+        try:
+            self.queue.put_nowait(("store", (kind, data, ext, session, station, label, time.time())))
+            return True
+        except Full:
+            self.dropped += 1
+            print(f"Archive queue full, dropped {kind} from station {station}")
+            return False
+
+    def path(self, digest, ext):
+        return os.path.join(self.root, digest[:2], digest[2:4], f"{digest}.{ext}")
+
+    def _open(self):
+        conn = sqlite3.connect(os.path.join(self.root, "index.db"))
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("""CREATE TABLE IF NOT EXISTS objects (
+                            digest TEXT PRIMARY KEY,
+                            ext TEXT NOT NULL,
+                            size INTEGER NOT NULL
+                        ) WITHOUT ROWID""")
+        conn.execute("""CREATE TABLE IF NOT EXISTS captures (
+                            id INTEGER PRIMARY KEY,
+                            digest TEXT NOT NULL,
+                            kind TEXT NOT NULL,
+                            session TEXT,
+                            station TEXT,
+                            label TEXT,
+                            created_at REAL NOT NULL
+                        )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS captures_created ON captures (created_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS captures_digest ON captures (digest)")
+        conn.execute("CREATE INDEX IF NOT EXISTS captures_station ON captures (station, created_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS captures_session ON captures (session)")
+        conn.commit()
+        self.total_bytes = conn.execute("SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()[0]
+        return conn
+
+    def _worker(self):
+        self._conn = self._open()
+        next_compaction = time.monotonic() + self.compact_interval
+        while True:
+            try:
+                item = self.queue.get(timeout=max(0.0, next_compaction - time.monotonic()))
+            except Empty:
+                item = ("compact", None)
+            if item is None:
+                break
+            action, args = item
+            if action == "query":
+                query, params, future = args
+                try:
+                    future.set_result([dict(row) for row in self._conn.execute(query, params)])
+                except Exception as e:
+                    future.set_exception(e)
+                continue
+            try:
+                if action == "store":
+                    self._store(*args)
+                    if self.total_bytes > self.max_bytes:
+                        self._evict()
+                elif action == "compact":
+                    self._compact()
+                    next_compaction = time.monotonic() + self.compact_interval
+            except Exception as e:
+                print(f"Archive {action} failed: {e}")
+        self._conn.close()
+
+    def _store(self, kind, data, ext, session, station, label, created_at):
+        started = time.perf_counter()
+        if not isinstance(data, (bytes, bytearray, memoryview)):
+            ok, buf = cv2.imencode(f".{ext}", data)
+            if not ok:
+                raise ValueError(f"could not encode {kind} as {ext}")
+            data = buf.tobytes()
+        digest = hashlib.sha256(data).hexdigest()
+        known = self._conn.execute("SELECT 1 FROM objects WHERE digest = ?", (digest,)).fetchone()
+        path = self.path(digest, ext)
+        if known and os.path.exists(path):
+            self.deduplicated += 1
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # written under a temporary name first so a crash never leaves a truncated object behind
+            tmp = f"{path}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+            if not known:
+                self.total_bytes += len(data)
+        with self._conn:
+            self._conn.execute("INSERT OR IGNORE INTO objects (digest, ext, size) VALUES (?, ?, ?)", (digest, ext, len(data)))
+            self._conn.execute("INSERT INTO captures (digest, kind, session, station, label, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                               (digest, kind, session, station, label, created_at))
+        self.written += 1
+        if self.metrics is not None:
+            self.metrics.observe("imwrite", time.perf_counter() - started)
+
+    def _evict(self):
+        # drops captures older than max_age, then the oldest ones until the store fits in max_bytes
+        with self._conn:
+            cursor = self._conn.execute("DELETE FROM captures WHERE created_at < ?", (time.time() - self.max_age,))
+            self.evicted += cursor.rowcount
+        removed = self._remove_unreferenced()
+        while self.total_bytes > self.max_bytes:
+            oldest = self._conn.execute("SELECT id FROM captures ORDER BY created_at LIMIT 64").fetchall()
+            if not oldest:
+                break
+            with self._conn:
+                self._conn.executemany("DELETE FROM captures WHERE id = ?", [(row["id"],) for row in oldest])
+            self.evicted += len(oldest)
+            removed += self._remove_unreferenced()
+        return removed
+
+    def _remove_unreferenced(self):
+        orphans = self._conn.execute("""SELECT digest, ext, size FROM objects
+                                        WHERE NOT EXISTS (SELECT 1 FROM captures WHERE captures.digest = objects.digest)""").fetchall()
+        for row in orphans:
+            try:
+                os.remove(self.path(row["digest"], row["ext"]))
+            except FileNotFoundError:
+                pass
+        with self._conn:
+            self._conn.executemany("DELETE FROM objects WHERE digest = ?", [(row["digest"],) for row in orphans])
+        self.total_bytes -= sum(row["size"] for row in orphans)
+        return len(orphans)
+
+    def _compact(self):
+        # periodic housekeeping: age/size eviction, files the index does not know about (left by a crash
+        # between write and insert), empty shard directories, and a WAL checkpoint
+        started = time.perf_counter()
+        removed = self._evict()
+        known = {(row["digest"], row["ext"]) for row in self._conn.execute("SELECT digest, ext FROM objects")}
+        for shard, dirs, files in os.walk(self.root, topdown=False):
+            if shard == self.root:
+                continue
+            for name in files:
+                digest, _, ext = name.partition(".")
+                if (digest, ext) not in known:
+                    os.remove(os.path.join(shard, name))
+                    removed += 1
+            if not os.listdir(shard):
+                os.rmdir(shard)
+        self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.last_compaction = time.time()
+        if removed:
+            print(f"Archive compaction removed {removed} files in {time.perf_counter() - started:.2f}s")
+
+    def compact(self):
+        try:
+            self.queue.put_nowait(("compact", None))
+            return True
+        except Full:
+            return False
+
+    def find(self, session=None, station=None, label=None, since=None, limit=100, timeout=5.0):
+        # index lookup, answered by the archive thread so the connection stays single-threaded; raises
+        # queue.Full when the write queue stays full for `timeout` seconds
+        clauses, params = [], []
+        for column, value in (("session", session), ("station", station), ("label", label)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            clauses.append("created_at >= ?")
+            params.append(since)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        query = f"""SELECT captures.*, objects.ext, objects.size FROM captures JOIN objects USING (digest)
+                    {where} ORDER BY created_at DESC LIMIT ?"""
+        future = Future()
+        self.queue.put(("query", (query, params + [limit], future)), timeout=timeout)
+        rows = future.result(timeout=timeout)
+        for row in rows:
+            row["path"] = self.path(row["digest"], row["ext"])
+        return rows
+
+    def stats(self):
+        return {
+            "root": self.root,
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "max_age_s": self.max_age,
+            "pending": self.queue.qsize(),
+            "written": self.written,
+            "deduplicated": self.deduplicated,
+            "dropped": self.dropped,
+            "evicted": self.evicted,
+            "last_compaction": self.last_compaction,
+        }
+
+    def close(self):
+        try:
+            self.queue.put_nowait(None)
+        except Full:
+            pass
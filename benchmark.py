@@ -0,0 +1,266 @@
+"""Offline replay benchmark for the disposal pipeline.
+
+Replays recorded JPEG frames, WAV clips and ultrasonic traces through the real Flask endpoints and
+process_image, with OpenAI / Google Vision and the LED controllers replaced by the local stubs in
+stubs.py, and reports per-stage and end-to-end latency, throughput at N stations and peak RSS:
+
+    python -m Smart_waste_classification.benchmark recordings/ --stations 1,4,8 --out results.json
+
+recordings/ holds *.jpg frames, *.wav clips and *.json traces; a trace is a list of
+{"dt": seconds, "status": 0|1|2} samples (or [dt, status] pairs) replayed through /distance/batch.
+"""
+import argparse
+import glob
+import json
+import os
+import resource
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+from Smart_waste_classification.stubs import StubServer, FakeLedServer
+
+# used when the recordings have no traces: the item settles in the recyclable bin, then the lid clears
+DEFAULT_TRACE = [{"dt": 0.0, "status": 0}, {"dt": 0.4, "status": 1}, {"dt": 0.6, "status": 1}, {"dt": 1.5, "status": 0}]
+# functions in api.py / server.py timed as pipeline stages
+STAGES = ("decode_frame", "run_detection", "classify_waste", "transcribe_audio", "match_speaker",
+          "resolve_identity", "record_disposal")
+
+def percentile(samples, q):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def summarize(samples):
+    return {
+        "count": len(samples),
+        "mean": round(sum(samples) / len(samples), 4) if samples else None,
+        "p50": round(percentile(samples, 0.50), 4) if samples else None,
+        "p95": round(percentile(samples, 0.95), 4) if samples else None,
+        "p99": round(percentile(samples, 0.99), 4) if samples else None,
+    }
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def load_trace(path):
+    with open(path) as f:
+        samples = json.load(f)
+    return [s if isinstance(s, dict) else {"dt": s[0], "status": s[1]} for s in samples]
+
+def load_recordings(folder):
+    frames = []
+    for path in sorted(glob.glob(os.path.join(folder, "*.jpg")) + glob.glob(os.path.join(folder, "*.jpeg"))):
+        with open(path, "rb") as f:
+            frames.append(f.read())
+    clips = sorted(os.path.abspath(p) for p in glob.glob(os.path.join(folder, "*.wav")))
+    traces = [load_trace(p) for p in sorted(glob.glob(os.path.join(folder, "*.json")))] or [DEFAULT_TRACE]
+    if not frames or not clips:
+        raise SystemExit(f"{folder} needs at least one .jpg frame and one .wav clip")
+    return frames, clips, traces
+
+class StageTimer:
+    # replaces module-level functions with timing wrappers; calls between them go through the module
+    # globals, so nested stages are timed as well. A function imported into several modules is
+    # rebound in each of them
+    def __init__(self, modules, names):
+        self.samples = {name: [] for name in names}
+        self._lock = threading.Lock()
+        for name in names:
+            original = next(getattr(m, name) for m in modules if hasattr(m, name))
+            wrapped = self._wrap(name, original)
+            for module in modules:
+                if getattr(module, name, None) is original:
+                    setattr(module, name, wrapped)
+
+    def _wrap(self, name, fn):
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.record(name, time.perf_counter() - started)
+        return timed
+
+    def record(self, name, seconds):
+        with self._lock:
+            self.samples.setdefault(name, []).append(seconds)
+
+    def reset(self):
+        with self._lock:
+            for samples in self.samples.values():
+                samples.clear()
+
+    def summary(self):
+        with self._lock:
+            return {name: summarize(samples) for name, samples in self.samples.items()}
+
+def prepare_workdir(workdir):
+    # the server keeps users.db, caches and archives in the working directory
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    conn = sqlite3.connect("users.db")
+    conn.execute("""CREATE TABLE IF NOT EXISTS users (
+                        name TEXT PRIMARY KEY, id INT, score REAL, reminder_items TEXT, complete_times INT)""")
+    conn.commit()
+    conn.close()
+
+def replay_disposal(server, client, timer, station_id, frame, clip, trace, clock):
+    started = time.perf_counter()
+    server.start_detection(station_id)
+
+    stage_started = time.perf_counter()
+    identity = ""
+    for _, _, identity in server.record_and_identify(station_id, voice_source=clip, realtime=False):
+        pass
+    timer.record("identify", time.perf_counter() - stage_started)
+    if not identity or identity == "Unknown":
+        return False
+
+    stage_started = time.perf_counter()
+    response = client.post(f"/image?station={station_id}", data=frame, content_type="image/jpeg")
+    timer.record("image_request", time.perf_counter() - stage_started)
+    if response.status_code != 200 or response.get_json().get("status") != "success":
+        return False
+
+    # each station has its own clock so back-to-back disposals are not debounced as one
+    samples = [{"station": station_id, "status": s["status"], "ts": clock + s["dt"]} for s in trace]
+    stage_started = time.perf_counter()
+    response = client.post("/distance/batch", json={"samples": samples})
+    timer.record("distance_request", time.perf_counter() - stage_started)
+    completed = not server.sessions.get(station_id).is_running
+    if completed:
+        timer.record("end_to_end", time.perf_counter() - started)
+    return completed
+
+def run_stations(server, client, timer, recordings, stations, disposals):
+    frames, clips, traces = recordings
+    timer.reset()
+    results = {"completed": 0, "failed": 0}
+    lock = threading.Lock()
+
+    def worker(index):
+        station_id = f"bench{index}"
+        debounce = server.sessions.get(station_id).sensor.debounce
+        clock = time.time()
+        for i in range(disposals):
+            n = index + i
+            trace = traces[n % len(traces)]
+            ok = replay_disposal(server, client, timer, station_id, frames[n % len(frames)], clips[n % len(clips)], trace, clock)
+            clock += max(s["dt"] for s in trace) + debounce + 1
+            with lock:
+                results["completed" if ok else "failed"] += 1
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(stations)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+
+    return {
+        "stations": stations,
+        "disposals": results["completed"] + results["failed"],
+        "completed": results["completed"],
+        "failed": results["failed"],
+        "wall_seconds": round(wall, 3),
+        "throughput_per_second": round(results["completed"] / wall, 3) if wall else None,
+        "stages": timer.summary(),
+        "server": {path: client.get(path).get_json() for path in
+                   ("/stats/inference", "/stats/remote", "/stats/speculative", "/stats/label_cache", "/stats/leds")},
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def compare(results, baseline_file):
+    # prints the p95 change of every stage against an earlier results file
+    with open(baseline_file) as f:
+        baseline = {run["stations"]: run for run in json.load(f)["runs"]}
+    for run in results["runs"]:
+        old = baseline.get(run["stations"])
+        if old is None:
+            continue
+        print(f"{run['stations']} stations: throughput {old['throughput_per_second']} -> {run['throughput_per_second']}/s, "
+              f"peak RSS {old['peak_rss_mb']} -> {run['peak_rss_mb']} MB")
+        for stage, summary in run["stages"].items():
+            before = old["stages"].get(stage, {}).get("p95")
+            if before and summary["p95"]:
+                print(f"  {stage:<18} p95 {before:.4f}s -> {summary['p95']:.4f}s ({(summary['p95'] / before - 1) * 100:+.1f}%)")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recordings", help="folder with *.jpg frames, *.wav clips and *.json ultrasonic traces")
+    parser.add_argument("--stations", default="1,4", help="comma-separated station counts to run")
+    parser.add_argument("--disposals", type=int, default=10, help="disposals replayed per station")
+    parser.add_argument("--chat-latency", type=float, default=0.8, help="stub GPT-4 latency in seconds")
+    parser.add_argument("--vision-latency", type=float, default=0.3, help="stub Google Vision latency in seconds")
+    parser.add_argument("--weights", default="yolov8trained.pt", help="YOLO weights")
+    parser.add_argument("--workdir", default=None, help="where users.db, caches and archives go (default: a temp dir)")
+    parser.add_argument("--out", default="benchmark_results.json")
+    parser.add_argument("--baseline", default=None, help="earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    recordings = load_recordings(args.recordings)
+    station_counts = [int(n) for n in args.stations.split(",")]
+    out = os.path.abspath(args.out)
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+
+    stub = StubServer({"chat": args.chat_latency, "vision": args.vision_latency}).start()
+    led = FakeLedServer().start()
+    # the server reads its configuration at import time
+    os.environ["REMOTE_STUB_URL"] = stub.url
+    os.environ["LED_CONTROLLERS"] = ",".join(f"bench{i}={led.url}" for i in range(max(station_counts)))
+    os.environ["YOLO_WEIGHTS"] = os.path.abspath(args.weights)
+    os.environ["MODEL_PRELOAD"] = "0"
+    prepare_workdir(args.workdir or tempfile.mkdtemp(prefix="waste-bench-"))
+    print(f"Working directory {os.getcwd()}")
+
+    from Smart_waste_classification import server, api
+
+    load_started = time.perf_counter()
+    server.models.start("whisper", "yolo")
+    server.models.get("whisper")
+    server.models.get("yolo")
+    load_seconds = time.perf_counter() - load_started
+
+    timer = StageTimer([api, server], STAGES)
+    client = server.app.test_client()
+    results = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {"disposals_per_station": args.disposals, "chat_latency": args.chat_latency,
+                   "vision_latency": args.vision_latency, "weights": args.weights,
+                   "frames": len(recordings[0]), "clips": len(recordings[1]), "traces": len(recordings[2]),
+                   "speculative_vision": api.SPECULATIVE_VISION, "yolo_max_batch": api.YOLO_MAX_BATCH},
+        "import_seconds": {k: round(v, 3) for k, v in api.IMPORT_SECONDS.items()},
+        "model_load_seconds": round(load_seconds, 3),
+        "runs": [],
+    }
+    try:
+        for stations in station_counts:
+            print(f"Replaying {args.disposals} disposals at each of {stations} stations...")
+            run = run_stations(server, client, timer, recordings, stations, args.disposals)
+            e2e = run["stages"].get("end_to_end", {})
+            print(f"  {run['completed']}/{run['disposals']} completed, {run['throughput_per_second']}/s, "
+                  f"end-to-end p50 {e2e.get('p50')}s p95 {e2e.get('p95')}s p99 {e2e.get('p99')}s, "
+                  f"peak RSS {run['peak_rss_mb']} MB")
+            results["runs"].append(run)
+        results["stub_requests"] = stub.requests
+        results["led_messages"] = len(led.messages)
+    finally:
+        server.cleanup()
+        stub.stop()
+        led.stop()
+
+    with open(out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {out}")
+    if baseline:
+        compare(results, baseline)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import json
+import os
+
+import numpy as np
+
+CATEGORIES = ("Recyclable Waste", "Non-Recyclable Waste")
+DEFAULT_CATEGORY = 1
+
+class ClassificationUnavailable(Exception):
+    # raised by classify when it could only give fallback answers, which must not be saved
+    pass
+
+def table_path(weights_path):
+    # stored next to the weights, e.g. yolov8trained.categories.json
+    return os.path.splitext(weights_path)[0] + ".categories.json"
+
+def load_category_table(weights_path, names, classify):
+    # uint8 array: YOLO class id -> index into CATEGORIES
+    # classify(labels) is only called when no saved table matches the model's class names; a table built
+    # while classify raises ClassificationUnavailable is used for this run only
+    path = table_path(weights_path)
+    labels = [names[i] for i in range(len(names))]
+    by_label = None
+    if os.path.exists(path):
+        try:
+            with open(path) as f:
+                saved = json.load(f)
+            if saved.get("names") == labels:
+                by_label = saved["categories"]
+        except Exception as e:
+            print(f"Error reading category table {path}: {e}")
+
+    if by_label is None:
+        print(f"Building category table for {len(labels)} YOLO classes...")
+        by_label = {}
+        try:
+            for c in classify(labels):
+                by_label[c["item"]] = c["category"]
+        except ClassificationUnavailable as e:
+            print(f"Category classification unavailable: {e}")
+            by_label = {}
+        if by_label:
+            for label in labels:
+                by_label.setdefault(label, CATEGORIES[DEFAULT_CATEGORY])
+            with open(path, "w") as f:
+                json.dump({"names": labels, "categories": by_label}, f, indent=2)
+        else:
+            print("Could not classify YOLO classes, defaulting to Non-Recyclable Waste until the next start")
+
+    table = np.full(len(labels), DEFAULT_CATEGORY, dtype=np.uint8)
+    for class_id, label in enumerate(labels):
+        category = by_label.get(label)
+        if category in CATEGORIES:
+            table[class_id] = CATEGORIES.index(category)
+    return table
@@ -1,67 +1,334 @@
 import sqlite3
 import json
+import threading
+from contextlib import contextmanager
+from queue import LifoQueue, Empty, Full
 
 DATABASE_FILE = "users.db"
 
-def get_db_connection():
-    conn = sqlite3.connect(DATABASE_FILE)
-    conn.row_factory = sqlite3.Row
-    return conn
+def migrate_reminders(conn):
+    # v1: reminder items move from the users.reminder_items JSON blob to an indexed reminders table
+    conn.execute("""CREATE TABLE IF NOT EXISTS reminders (
+                        user_name TEXT NOT NULL,
+                        item TEXT NOT NULL,
+                        misses INTEGER NOT NULL DEFAULT 1,
+                        PRIMARY KEY (user_name, item)
+                    ) WITHOUT ROWID""")
+    rows = []
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users'").fetchone():
+        rows = conn.execute("SELECT name, reminder_items FROM users WHERE reminder_items IS NOT NULL AND reminder_items != '[]'").fetchall()
+    for row in rows:
+        try:
+            items = json.loads(row["reminder_items"])
+        except ValueError:
+            items = []
+        conn.executemany("INSERT OR IGNORE INTO reminders (user_name, item, misses) VALUES (?, ?, 1)",
+                         [(row["name"], item.lower()) for item in items if item])
+    # the column is kept for older tools but no longer read
+    if rows:
+        conn.execute("UPDATE users SET reminder_items = '[]'")
+        print(f"Migrated {len(rows)} users' reminder items to the reminders table")
 
-def get_user_by_name(name):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT name, id, score, reminder_items, complete_times FROM users WHERE name = ?", (name,))
-    row = cur.fetchone()
-    conn.close()
-    if row:
-        reminder_items = []
-        if row["reminder_items"]:
-            reminder_items = json.loads(row["reminder_items"])
+def create_speaker_embeddings(conn):
+    # v2: one float32 voice embedding per enrolled user
+    conn.execute("""CREATE TABLE IF NOT EXISTS speaker_embeddings (
+                        user_name TEXT PRIMARY KEY,
+                        embedding BLOB NOT NULL,
+                        samples INTEGER NOT NULL DEFAULT 1,
+                        updated_at REAL NOT NULL
+                    )""")
+
+def create_disposal_log(conn):
+    # v3: append-only disposal events plus aggregates kept up to date as events are appended, so
+    # leaderboards, per-item error rates and per-station volume are index lookups rather than scans
+    conn.execute("""CREATE TABLE IF NOT EXISTS disposal_events (
+                        id INTEGER PRIMARY KEY,
+                        created_at REAL NOT NULL,
+                        station TEXT NOT NULL,
+                        session TEXT,
+                        user_name TEXT,
+                        item TEXT,
+                        category TEXT,
+                        bin INTEGER,
+                        correct INTEGER NOT NULL
+                    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS disposal_events_user ON disposal_events (user_name, created_at)")
+    conn.execute("""CREATE TABLE IF NOT EXISTS user_stats (
+                        user_name TEXT PRIMARY KEY,
+                        disposals INTEGER NOT NULL,
+                        correct INTEGER NOT NULL,
+                        accuracy REAL NOT NULL,
+                        last_at REAL
+                    ) WITHOUT ROWID""")
+    conn.execute("CREATE INDEX IF NOT EXISTS user_stats_rank ON user_stats (accuracy DESC, disposals DESC)")
+    conn.execute("""CREATE TABLE IF NOT EXISTS item_stats (
+                        item TEXT PRIMARY KEY,
+                        disposals INTEGER NOT NULL,
+                        errors INTEGER NOT NULL,
+                        error_rate REAL NOT NULL,
+                        last_at REAL
+                    ) WITHOUT ROWID""")
+    conn.execute("CREATE INDEX IF NOT EXISTS item_stats_errors ON item_stats (error_rate DESC, disposals DESC)")
+    conn.execute("""CREATE TABLE IF NOT EXISTS station_hour_stats (
+                        station TEXT NOT NULL,
+                        hour INTEGER NOT NULL,
+                        disposals INTEGER NOT NULL,
+                        correct INTEGER NOT NULL,
+                        PRIMARY KEY (station, hour)
+                    ) WITHOUT ROWID""")
+    conn.execute("CREATE INDEX IF NOT EXISTS station_hour_stats_hour ON station_hour_stats (hour)")
+    # earlier disposals only survive as users.score / complete_times; seed the user totals from them
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users'").fetchone():
+        conn.execute("""INSERT OR IGNORE INTO user_stats (user_name, disposals, correct, accuracy, last_at)
+                        SELECT name, complete_times, CAST(ROUND(score * complete_times / 100.0) AS INTEGER),
+                               ROUND(score / 100.0, 4), NULL
+                        FROM users WHERE complete_times > 0 AND score IS NOT NULL""")
+
+MIGRATIONS = [migrate_reminders, create_speaker_embeddings, create_disposal_log]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def migrate(conn):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for step in range(version, SCHEMA_VERSION):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            MIGRATIONS[step](conn)
+            conn.execute(f"PRAGMA user_version = {step + 1}")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+class UserRepository:
+    # one connection per thread, WAL journal, statements reused through sqlite3's statement cache.
+    # Threads that only live for one request (Flask's development server starts one per request) hand
+    # their connection back with release(), and the next thread reuses it from a pool of up to
+    # `pool_size` idle connections instead of reconnecting
+    def __init__(self, db_file=DATABASE_FILE, pool_size=8):
+        self.db_file = db_file
+        self._idle = LifoQueue(maxsize=pool_size)
+        self._local = threading.local()
+        self._migrate_lock = threading.Lock()
+        self._migrated = False
+        # called as listener(name, user_id) after create_user inserts a row
+        self.user_created_listeners = []
+
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            try:
+                conn = self._idle.get_nowait()
+            except Empty:
+                # used by one thread at a time, but not always the thread that opened it
+                conn = sqlite3.connect(self.db_file, isolation_level=None, cached_statements=64, timeout=5.0,
+                                       check_same_thread=False)
+                conn.row_factory = sqlite3.Row
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            if not self._migrated:
+                with self._migrate_lock:
+                    if not self._migrated:
+                        migrate(conn)
+                        self._migrated = True
+        return conn
+
+    def release(self):
+        # returns this thread's connection to the pool; the next connection() call checks one out again
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            return
+        self._local.conn = None
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self._idle.put_nowait(conn)
+        except Full:
+            conn.close()
+
+    @contextmanager
+    def transaction(self):
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def get_user_by_name(self, name, conn=None):
+        conn = conn or self.connection()
+        row = conn.execute("SELECT name, id, score, complete_times FROM users WHERE name = ?", (name,)).fetchone()
+        if not row:
+            return None
         return {
             "name": row["name"],
             "id": row["id"],
             "score": row["score"],           # can be None if first disposal not done yet
-            "reminder_items": reminder_items,
+            "reminder_items": self.get_reminder_items(name, conn),
             "complete_times": row["complete_times"]
         }
-    return None
+
+    def get_reminder_items(self, name, conn=None):
+        conn = conn or self.connection()
+        return {row[0] for row in conn.execute("SELECT item FROM reminders WHERE user_name = ?", (name,))}
+
+    def add_reminder(self, name, item, conn=None):
+        conn = conn or self.connection()
+        conn.execute("""INSERT INTO reminders (user_name, item, misses) VALUES (?, ?, 1)
+                        ON CONFLICT (user_name, item) DO UPDATE SET misses = misses + 1""", (name, item.lower()))
+
+    def create_user(self, name, user_id):
+        # Create a new user with score=None means no disposal has been done yet
+        # initial: score = NULL, complete_times=0
+        self.connection().execute("INSERT INTO users (name, id, score, reminder_items, complete_times) VALUES (?, ?, ?, ?, ?)",
+                                  (name, user_id, None, json.dumps([]), 0))
+        for listener in self.user_created_listeners:
+            listener(name, user_id)
+
+    def get_speaker_embeddings(self):
+        # [(user_name, embedding bytes, samples, updated_at)], ordered by name
+        return [tuple(row) for row in self.connection().execute(
+            "SELECT user_name, embedding, samples, updated_at FROM speaker_embeddings ORDER BY user_name")]
+
+    def save_speaker_embedding(self, name, embedding, samples, updated_at):
+        self.connection().execute("INSERT OR REPLACE INTO speaker_embeddings (user_name, embedding, samples, updated_at) VALUES (?, ?, ?, ?)",
+                                  (name, embedding, samples, updated_at))
+
+    def list_users(self):
+        conn = self.connection()
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users'").fetchone():
+            return []
+        return [(row["name"], row["id"]) for row in conn.execute("SELECT name, id FROM users")]
+
+    def update_user_score_and_times(self, name, new_score, new_times):
+        self.connection().execute("UPDATE users SET score = ?, complete_times = ? WHERE name = ?",
+                                  (new_score, new_times, name))
+
+    def update_user_reminder_items(self, name, reminder_items):
+        # replaces the whole reminder set; disposals should use add_reminder/record_disposal instead
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM reminders WHERE user_name = ?", (name,))
+            conn.executemany("INSERT OR IGNORE INTO reminders (user_name, item, misses) VALUES (?, ?, 1)",
+                             [(name, item.lower()) for item in reminder_items])
+
+    def record_disposal(self, name, correct, item):
+        # score, complete_times and reminders change together in one transaction; returns the updated user or None
+        with self.transaction() as conn:
+            user = self.get_user_by_name(name, conn)
+            if user is None:
+                return None
+            old_score = user["score"]
+            old_times = user["complete_times"]
+            if old_score is None:
+                # first disposal
+                new_score = 100.0 if correct else 0.0
+                new_times = 1
+            else:
+                if correct:
+                    new_score = (old_score * old_times + 100) / (old_times + 1)
+                else:
+                    new_score = (old_score * old_times) / (old_times + 1)
+                new_score = round(new_score, 3)
+                new_times = old_times + 1
+            conn.execute("UPDATE users SET score = ?, complete_times = ? WHERE name = ?", (new_score, new_times, name))
+
+            item_name_lower = (item or "").lower()
+            if not correct and item_name_lower:
+                self.add_reminder(name, item_name_lower, conn)
+                user["reminder_items"].add(item_name_lower)
+
+            user["score"] = new_score
+            user["complete_times"] = new_times
+            return user
+
+    def append_disposals(self, events):
+        # group commit: the events and every aggregate they touch are written in one transaction.
+        # events are dicts with created_at, station, session, user_name, item, category, bin and correct
+        users, items, hours = {}, {}, {}
+        for event in events:
+            correct = 1 if event["correct"] else 0
+            if event["user_name"]:
+                total = users.setdefault(event["user_name"], [0, 0, None])
+                total[0] += 1
+                total[1] += correct
+                total[2] = event["created_at"]
+            if event["item"]:
+                total = items.setdefault(event["item"], [0, 0, None])
+                total[0] += 1
+                total[1] += 1 - correct
+                total[2] = event["created_at"]
+            total = hours.setdefault((event["station"], int(event["created_at"] // 3600) * 3600), [0, 0])
+            total[0] += 1
+            total[1] += correct
+        with self.transaction() as conn:
+            conn.executemany("""INSERT INTO disposal_events (created_at, station, session, user_name, item, category, bin, correct)
+                                VALUES (:created_at, :station, :session, :user_name, :item, :category, :bin, :correct)""",
+                             [dict(event, correct=1 if event["correct"] else 0) for event in events])
+            conn.executemany("""INSERT INTO user_stats (user_name, disposals, correct, accuracy, last_at)
+                                VALUES (?1, ?2, ?3, ROUND(CAST(?3 AS REAL) / ?2, 4), ?4)
+                                ON CONFLICT (user_name) DO UPDATE SET
+                                    disposals = disposals + ?2, correct = correct + ?3,
+                                    accuracy = ROUND(CAST(correct + ?3 AS REAL) / (disposals + ?2), 4), last_at = ?4""",
+                             [(name, n, ok, at) for name, (n, ok, at) in users.items()])
+            conn.executemany("""INSERT INTO item_stats (item, disposals, errors, error_rate, last_at)
+                                VALUES (?1, ?2, ?3, ROUND(CAST(?3 AS REAL) / ?2, 4), ?4)
+                                ON CONFLICT (item) DO UPDATE SET
+                                    disposals = disposals + ?2, errors = errors + ?3,
+                                    error_rate = ROUND(CAST(errors + ?3 AS REAL) / (disposals + ?2), 4), last_at = ?4""",
+                             [(item, n, errors, at) for item, (n, errors, at) in items.items()])
+            conn.executemany("""INSERT INTO station_hour_stats (station, hour, disposals, correct) VALUES (?1, ?2, ?3, ?4)
+                                ON CONFLICT (station, hour) DO UPDATE SET disposals = disposals + ?3, correct = correct + ?4""",
+                             [(station, hour, n, ok) for (station, hour), (n, ok) in hours.items()])
+
+    def leaderboard(self, limit=10, min_disposals=1):
+        # walks the user_stats_rank index from the top
+        return [dict(row) for row in self.connection().execute(
+            """SELECT user_name, disposals, correct, accuracy, last_at FROM user_stats INDEXED BY user_stats_rank
+               WHERE disposals >= ? ORDER BY accuracy DESC, disposals DESC LIMIT ?""", (min_disposals, limit))]
+
+    def item_error_rates(self, limit=20, min_disposals=1):
+        # items most often put in the wrong bin, from the item_stats_errors index
+        return [dict(row) for row in self.connection().execute(
+            """SELECT item, disposals, errors, error_rate, last_at FROM item_stats INDEXED BY item_stats_errors
+               WHERE disposals >= ? ORDER BY error_rate DESC, disposals DESC LIMIT ?""", (min_disposals, limit))]
+
+    def station_volume(self, station=None, since=None, limit=168):
+        # hourly disposal counts, newest first; hour is the unix time the hour starts
+        clauses, params = ["hour >= ?"], [int((since or 0) // 3600) * 3600]
+        if station is not None:
+            clauses.append("station = ?")
+            params.append(station)
+        return [dict(row) for row in self.connection().execute(
+            f"""SELECT station, hour, disposals, correct FROM station_hour_stats WHERE {' AND '.join(clauses)}
+                ORDER BY hour DESC, station LIMIT ?""", params + [limit])]
+
+repository = UserRepository()
+
+def get_db_connection():
+    return repository.connection()
+
+def list_users():
+    return repository.list_users()
+
+def get_user_by_name(name):
+    return repository.get_user_by_name(name)
 
 def create_user(name, user_id):
-    # Create a new user with score=None means no disposal has been done yet
-    conn = get_db_connection()
-    cur = conn.cursor()
-    reminder_items_json = json.dumps([])
-    # initial: score = NULL, complete_times=0
-    cur.execute("INSERT INTO users (name, id, score, reminder_items, complete_times) VALUES (?, ?, ?, ?, ?)",
-                (name, user_id, None, reminder_items_json, 0))
-    conn.commit()
-    conn.close()
+    repository.create_user(name, user_id)
 
 def update_user_score_and_times(name, new_score, new_times):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("UPDATE users SET score = ?, complete_times = ? WHERE name = ?",
-                (new_score, new_times, name))
-    conn.commit()
-    conn.close()
+    repository.update_user_score_and_times(name, new_score, new_times)
 
 def update_user_reminder_items(name, reminder_items):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    reminder_items_json = json.dumps(reminder_items)
-    cur.execute("UPDATE users SET reminder_items = ? WHERE name = ?",
-                (reminder_items_json, name))
-    conn.commit()
-    conn.close()
+    repository.update_user_reminder_items(name, reminder_items)
+
+def record_disposal(name, correct, item):
+    return repository.record_disposal(name, correct, item)
 
 def set_user_first_disposal(name, correct):
     # For first disposal: if correct, score=100, times=1; if incorrect, score=0, times=1
     new_score = 100.0 if correct else 0.0
     new_times = 1
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("UPDATE users SET score = ?, complete_times = ? WHERE name = ?",
-                (new_score, new_times, name))
-    conn.commit()
-    conn.close()
\ No newline at end of file
+    repository.update_user_score_and_times(name, new_score, new_times)
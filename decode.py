@@ -0,0 +1,72 @@
+import struct
+
+import cv2
+import numpy as np
+
+# OpenCV can decode JPEGs at 1/2, 1/4 or 1/8 size directly, skipping most of the IDCT work
+REDUCED_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+def jpeg_size(data):
+    # (width, height) from the JPEG frame header, or None if it cannot be found
+    if len(data) < 4 or data[0] != 0xFF or data[1] != 0xD8:
+        return None
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        length = struct.unpack(">H", data[i + 2:i + 4])[0]
+        if marker in SOF_MARKERS:
+            height, width = struct.unpack(">HH", data[i + 5:i + 9])
+            return width, height
+        i += 2 + length
+    return None
+
+def parse_rois(spec):
+    # "bin1=0.2,0.1,0.8,0.9;bin2=..." -> {"bin1": (x0, y0, x1, y1)} as fractions of the frame;
+    # raises ValueError for a box that is malformed or would crop to nothing
+    rois = {}
+    for part in (spec or "").split(";"):
+        if "=" in part:
+            station_id, box = part.split("=", 1)
+            try:
+                x0, y0, x1, y1 = (float(v) for v in box.split(","))
+            except ValueError:
+                raise ValueError(f"STATION_ROI for {station_id.strip()}: expected x0,y0,x1,y1, got {box!r}") from None
+            if not (0 <= x0 < x1 <= 1 and 0 <= y0 < y1 <= 1):
+                raise ValueError(f"STATION_ROI for {station_id.strip()}: need 0 <= x0 < x1 <= 1 and 0 <= y0 < y1 <= 1, got {box!r}")
+            rois[station_id.strip()] = (x0, y0, x1, y1)
+    return rois
+
+def decode_frame(data, target_side=640, roi=None):
+    # decodes at the smallest reduced size whose ROI still covers target_side pixels, crops, then
+    # resizes down to target_side; target_side=0 decodes at full resolution
+    buf = np.frombuffer(data, np.uint8)
+    flag = cv2.IMREAD_COLOR
+    size = jpeg_size(data) if target_side else None
+    if size:
+        x0, y0, x1, y1 = roi or (0.0, 0.0, 1.0, 1.0)
+        roi_side = max(size[0] * (x1 - x0), size[1] * (y1 - y0))
+        for factor, reduced in REDUCED_FLAGS:
+            if roi_side / factor >= target_side:
+                flag = reduced
+                break
+    image = cv2.imdecode(buf, flag)
+    if image is None:
+        return None
+    if roi:
+        h, w = image.shape[:2]
+        x0, y0, x1, y1 = roi
+        # at least one pixel, however thin the box
+        top, left = min(int(y0 * h), h - 1), min(int(x0 * w), w - 1)
+        image = image[top:max(int(y1 * h), top + 1), left:max(int(x1 * w), left + 1)]
+    if target_side:
+        h, w = image.shape[:2]
+        scale = target_side / max(h, w)
+        if scale < 1:
+            image = cv2.resize(image, (round(w * scale), round(h * scale)), interpolation=cv2.INTER_AREA)
+    return np.ascontiguousarray(image)
@@ -0,0 +1,85 @@
+import threading
+import time
+from queue import Queue, Full, Empty
+
+class DisposalLog:
+    # appends disposal events to the repository's disposal_events table from a background thread. Events
+    # arriving within `flush_interval` of each other (up to `batch_size`) share one transaction, which also
+    # updates the per-user, per-item and per-station-hour aggregates. A full queue drops the event rather
+    # than holding up the sensor request.
+    def __init__(self, repository, batch_size=64, flush_interval=0.5, max_pending=1024, metrics=None):
+        self.repository = repository
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.metrics = metrics
+        self.queue = Queue(maxsize=max_pending)
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+        self.failed = 0
+        self.last_flush = None
+        self.thread = threading.Thread(target=self._worker, daemon=True, name="disposal-log")
+        self.thread.start()
+
+    def append(self, station, correct, user_name=None, item=None, category=None, bin=None, session=None):
+        event = {"created_at": time.time(), "station": station, "session": session, "user_name": user_name,
+                 "item": (item or "").lower() or None, "category": category, "bin": bin, "correct": bool(correct)}
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except Full:
+            self.dropped += 1
+            print(f"Disposal log queue full, dropped event from station {station}")
+            return False
+
+    def _worker(self):
+        stopping = False
+        while not stopping:
+            event = self.queue.get()
+            if event is None:
+                break
+            batch = [event]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    event = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except Empty:
+                    break
+                if event is None:
+                    stopping = True
+                    break
+                batch.append(event)
+            self._flush(batch)
+
+    def _flush(self, batch):
+        started = time.perf_counter()
+        try:
+            self.repository.append_disposals(batch)
+        except Exception as e:
+            self.failed += len(batch)
+            print(f"Disposal log lost {len(batch)} events: {e}")
+            return
+        self.written += len(batch)
+        self.batches += 1
+        self.last_flush = time.time()
+        if self.metrics is not None:
+            self.metrics.observe("disposal_log", time.perf_counter() - started)
+
+    def stats(self):
+        return {
+            "pending": self.queue.qsize(),
+            "written": self.written,
+            "batches": self.batches,
+            "mean_batch": round(self.written / self.batches, 2) if self.batches else None,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "last_flush": self.last_flush,
+        }
+
+    def close(self, timeout=5.0):
+        # flushes whatever is queued before returning
+        try:
+            self.queue.put(None, timeout=timeout)
+        except Full:
+            return
+        self.thread.join(timeout)
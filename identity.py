@@ -0,0 +1,135 @@
+import re
+import threading
+
+DIGIT_WORDS = {"zero": "0", "oh": "0", "one": "1", "two": "2", "three": "3", "four": "4",
+               "five": "5", "six": "6", "seven": "7", "eight": "8", "nine": "9"}
+FILLER_WORDS = {"my", "name", "is", "i", "am", "im", "i'm", "it's", "its", "this", "hi", "hello", "hey",
+                "the", "user", "id", "number", "and", "a", "called", "me", "call", "here", "uh", "um"}
+
+# confidence of a match on a spoken ID when no name was spoken at all
+ID_MATCH_CONFIDENCE = 0.85
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def dice(a, b):
+    if not a or not b:
+        return 0.0
+    return 2 * len(a & b) / (len(a) + len(b))
+
+def extract_numbers(transcript):
+    # digit runs, including spoken digits ("one two three" -> "123")
+    numbers = []
+    run = ""
+    for word in re.findall(r"[a-z]+|\d+", transcript.lower()):
+        if word.isdigit():
+            run += word
+        elif word in DIGIT_WORDS:
+            run += DIGIT_WORDS[word]
+        else:
+            if run:
+                numbers.append(int(run))
+            run = ""
+    if run:
+        numbers.append(int(run))
+    return numbers
+
+def extract_name_tokens(transcript):
+    words = re.findall(r"[a-z]+", transcript.lower())
+    return [w for w in words if w not in FILLER_WORDS and w not in DIGIT_WORDS]
+
+def extract_name_runs(transcript):
+    # runs of consecutive name words; filler words, digits and punctuation end a run, so
+    # "my name is bob jones, id 42" gives ["bob jones"]
+    runs, run = [], []
+    for word in re.findall(r"[a-z]+|\d+|[^\sa-z\d]", transcript.lower()):
+        if word.isalpha() and word not in FILLER_WORDS and word not in DIGIT_WORDS:
+            run.append(word)
+        elif run:
+            runs.append(" ".join(run))
+            run = []
+    if run:
+        runs.append(" ".join(run))
+    return runs
+
+class IdentityMatch:
+    __slots__ = ("name", "user_id", "confidence")
+
+    def __init__(self, name, user_id, confidence):
+        self.name = name
+        self.user_id = user_id
+        self.confidence = confidence
+
+    def as_identity(self):
+        # same "Name: ...\nID: ..." text process_identity produces
+        return f"Name: {self.name}\nID: {self.user_id}"
+
+class IdentityResolver:
+    def __init__(self, users=()):
+        self._lock = threading.Lock()
+        self._grams = {}     # trigram -> set of names
+        self._name_grams = {}
+        self._ids = {}       # name -> id
+        self._by_id = {}     # id -> set of names
+        for name, user_id in users:
+            self.add(name, user_id)
+
+    def add(self, name, user_id):
+        name = name.lower()
+        grams = trigrams(name)
+        with self._lock:
+            self._name_grams[name] = grams
+            self._ids[name] = user_id
+            self._by_id.setdefault(user_id, set()).add(name)
+            for gram in grams:
+                self._grams.setdefault(gram, set()).add(name)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _name_score(self, name, runs):
+        # best match of the name against a whole run of spoken name words: words of the run the name does
+        # not cover lower the score, so "bob jones" is not a match for "bob"
+        grams = self._name_grams[name]
+        return max((dice(grams, trigrams(run)) for run in runs), default=0.0)
+
+    def resolve(self, transcript):
+        tokens = extract_name_tokens(transcript)
+        runs = extract_name_runs(transcript)
+        numbers = extract_numbers(transcript)
+        with self._lock:
+            candidates = {}
+            for i in range(len(tokens)):
+                for window in (tokens[i], " ".join(tokens[i:i + 2])):
+                    for gram in trigrams(window):
+                        for name in self._grams.get(gram, ()):
+                            candidates[name] = candidates.get(name, 0) + 1
+            best_name, best_score = None, 0.0
+            for name, _ in sorted(candidates.items(), key=lambda c: -c[1])[:20]:
+                score = self._name_score(name, runs)
+                if score > best_score:
+                    best_name, best_score = name, score
+
+            id_name = None
+            for number in numbers:
+                names = self._by_id.get(number)
+                if names and len(names) == 1:
+                    id_name = next(iter(names))
+                    break
+
+            if id_name is not None:
+                if not tokens:
+                    # only an ID was spoken
+                    return IdentityMatch(id_name, self._ids[id_name], ID_MATCH_CONFIDENCE)
+                id_score = self._name_score(id_name, runs)
+                if best_name not in (None, id_name) and best_score > 0.8 and best_score > id_score:
+                    # the spoken name and the spoken ID point at different users
+                    return IdentityMatch(best_name, self._ids[best_name], 0.5)
+                # with a name spoken, the ID only picks between users and never raises the confidence: the
+                # name has to clear the caller's threshold on its own, or the transcript goes to the full
+                # identification path (it may be a new user who picked a taken ID)
+                return IdentityMatch(id_name, self._ids[id_name], id_score)
+            if best_name is None:
+                return IdentityMatch(None, None, 0.0)
+            return IdentityMatch(best_name, self._ids[best_name], best_score)
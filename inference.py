@@ -0,0 +1,414 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future
+from queue import Queue, Empty
+
+import numpy as np
+
+class DetectionModel:
+    # YOLO weights plus everything derived from them, swapped as one unit
+    __slots__ = ("weights", "yolo", "names", "category_table")
+
+    def __init__(self, weights, yolo, category_table):
+        self.weights = weights
+        self.yolo = yolo
+        self.names = yolo.names
+        self.category_table = category_table
+
+def as_numpy(values):
+    # ultralytics hands back torch tensors, the process pool plain arrays
+    return values.cpu().numpy() if hasattr(values, "cpu") else np.asarray(values)
+
+class BatchScheduler:
+    def __init__(self, get_model, max_batch_size=8, max_wait=0.02, metrics=None, runner=None, concurrency=1,
+                 **predict_kwargs):
+        # get_model() returns the current DetectionModel, so a hot swap takes effect at the next batch.
+        # runner(detection_model, images) replaces the in-process forward pass (see InferencePool); with
+        # concurrency > 1 that many batches can be in flight at once
+        self.get_model = get_model
+        self.metrics = metrics
+        self.runner = runner
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.predict_kwargs = predict_kwargs
+        self.queue = Queue()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = {}
+        self._frames = 0
+        self._batches = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self.threads = [threading.Thread(target=self._worker, daemon=True, name=f"yolo-batch-{n}") for n in range(concurrency)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, image):
+        future = Future()
+        self.queue.put((image, time.monotonic(), future))
+        return future
+
+    def predict(self, image, timeout=None):
+        # returns (DetectionModel, ultralytics Results) for this one frame
+        return self.submit(image).result(timeout=timeout)
+
+    def _collect(self):
+        first = self.queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = first[1] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=remaining)
+            except Empty:
+                break
+            if item is None:
+                self.queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _worker(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                self.queue.put(None)
+                break
+            started = time.monotonic()
+            live = [(img, f) for img, _, f in batch if f.set_running_or_notify_cancel()]
+            if not live:
+                continue
+            images = [img for img, _ in live]
+            futures = [f for _, f in live]
+            try:
+                detection_model = self.get_model()
+                forward_started = time.perf_counter()
+                if self.runner is not None:
+                    results = self.runner(detection_model, images)
+                else:
+                    results = detection_model.yolo(source=images, **self.predict_kwargs)
+                if self.metrics is not None:
+                    self.metrics.observe("yolo_batch", time.perf_counter() - forward_started)
+                for future, result in zip(futures, results):
+                    future.set_result((detection_model, result))
+            except Exception as e:
+                print(f"Error in batched inference: {e}")
+                for future in futures:
+                    future.set_exception(e)
+            self._record(len(images), [started - t for _, t, _ in batch])
+
+    def _record(self, size, waits):
+        with self._stats_lock:
+            self._batches += 1
+            self._frames += size
+            self._batch_sizes[size] = self._batch_sizes.get(size, 0) + 1
+            self._wait_total += sum(waits)
+            self._wait_max = max(self._wait_max, max(waits))
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": round(self.max_wait * 1000, 3),
+                "batches": self._batches,
+                "frames": self._frames,
+                "mean_batch_size": round(self._frames / self._batches, 3) if self._batches else 0.0,
+                "batch_size_counts": dict(sorted(self._batch_sizes.items())),
+                "mean_queue_wait_ms": round(self._wait_total / self._frames * 1000, 3) if self._frames else 0.0,
+                "max_queue_wait_ms": round(self._wait_max * 1000, 3),
+                "pending": self.queue.qsize(),
+            }
+
+    def close(self):
+        self.queue.put(None)
+
+class PooledBoxes:
+    # the parts of ultralytics' Boxes the server reads, as plain arrays
+    __slots__ = ("cls", "conf", "xyxy")
+
+    def __init__(self, cls, conf, xyxy):
+        self.cls = cls
+        self.conf = conf
+        self.xyxy = xyxy
+
+    def __len__(self):
+        return len(self.conf)
+
+class PooledResult:
+    __slots__ = ("boxes",)
+
+    def __init__(self, boxes):
+        self.boxes = boxes
+
+def _pool_worker(conn, yolo, predict_kwargs, threads):
+    # child process: `yolo` was inherited from the parent at fork, so its weights are shared copy-on-write
+    from multiprocessing import shared_memory
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    # warmed up here rather than in the parent, whose inference thread pools would not survive a fork
+    yolo(np.zeros((640, 640, 3), dtype=np.uint8), verbose=False, **predict_kwargs)
+    conn.send(("ready", None))
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        name, shapes = message
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+            try:
+                images, offset = [], 0
+                for shape in shapes:
+                    size = int(np.prod(shape))
+                    images.append(np.ndarray(shape, np.uint8, shm.buf, offset).copy())
+                    offset += size
+            finally:
+                shm.close()
+            results = yolo(source=images, verbose=False, **predict_kwargs)
+            conn.send(("ok", [(as_numpy(r.boxes.cls), as_numpy(r.boxes.conf), as_numpy(r.boxes.xyxy)) for r in results]))
+        except Exception as e:
+            conn.send(("error", repr(e)))
+    conn.close()
+
+class PoolWorker:
+    __slots__ = ("process", "conn", "detection_model", "frames", "started_at", "state")
+
+    def __init__(self, process, conn, detection_model):
+        self.process = process
+        self.conn = conn
+        self.detection_model = detection_model
+        self.frames = 0
+        self.started_at = time.time()
+        self.state = "serving"  # serving -> replacing (a successor is being forked) -> retiring
+
+class InferencePool:
+    # YOLO in separate processes, so inference does not share the GIL with request handling. Workers are
+    # forked from the parent after the model has loaded and keep its weights copy-on-write; frames go over
+    # shared memory and only the small box arrays come back.
+    # prepare(detection_model) forks and warms a full set of workers for a model; it is the model registry's
+    # warm-up hook, so it runs at load and during a hot swap before the new weights are served. A worker that
+    # has served `max_frames` frames, or has died, is replaced in the background: it keeps serving until its
+    # successor is warm, and is then retired off the request path.
+    def __init__(self, workers=2, max_frames=10000, threads_per_worker=1, start_method="fork", swap_grace=5.0,
+                 **predict_kwargs):
+        # swap_grace: how long the previous model's workers stay up after the new model is first used, for
+        # batches that picked up the old model just before the swap
+        self.size = workers
+        self.max_frames = max_frames
+        self.swap_grace = swap_grace
+        self.threads_per_worker = threads_per_worker
+        self.context = multiprocessing.get_context(start_method)
+        self.predict_kwargs = predict_kwargs
+        self._queues = {}  # DetectionModel -> Queue of its idle workers
+        self._latest = None
+        self._superseded = set()
+        self._closed = False
+        self.spawned = 0
+        self.recycled = 0
+        self.crashed = 0
+        self.frames = 0
+        self._lock = threading.Lock()
+
+    def _fork(self, detection_model):
+        from multiprocessing import resource_tracker
+        # started before forking so the workers share it and do not report the parent's segments as leaked
+        resource_tracker.ensure_running()
+        parent, child = self.context.Pipe()
+        process = self.context.Process(target=_pool_worker, daemon=True,
+                                       args=(child, detection_model.yolo, self.predict_kwargs, self.threads_per_worker))
+        process.start()
+        child.close()
+        return PoolWorker(process, parent, detection_model)
+
+    def _await_ready(self, worker):
+        try:
+            worker.conn.recv()  # ("ready", None) once warmed up
+        except EOFError:
+            self._retire(worker, timeout=0)
+            raise RuntimeError("inference worker exited during warm-up")
+        with self._lock:
+            self.spawned += 1
+        return worker
+
+    def prepare(self, detection_model):
+        # all workers are forked first so they warm up in parallel
+        workers = [self._fork(detection_model) for _ in range(self.size)]
+        ready, error = Queue(), None
+        for worker in workers:
+            try:
+                ready.put(self._await_ready(worker))
+            except RuntimeError as e:
+                error = e
+        if error is not None:
+            while not ready.empty():
+                self._retire(ready.get_nowait(), timeout=1.0)
+            raise error
+        with self._lock:
+            self._queues[detection_model] = ready
+            self._latest = detection_model
+
+    def _retire(self, worker, timeout=5.0):
+        # lets the worker exit on its own once idle; only a hung one is terminated
+        try:
+            worker.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        worker.process.join(timeout)
+        if worker.process.is_alive():
+            worker.process.terminate()
+            worker.process.join()
+        worker.conn.close()
+
+    def _background(self, target, *args):
+        threading.Thread(target=target, args=args, daemon=True, name="inference-pool").start()
+
+    def _replace(self, worker, worn_out=False):
+        # background: fork and warm a successor, hand it to the queue, then retire the old worker;
+        # worn_out marks a worker replaced for reaching max_frames (counted as recycled) rather than a crash
+        detection_model = worker.detection_model
+        while True:
+            with self._lock:
+                queue = None if self._closed else self._queues.get(detection_model)
+            if queue is None:
+                break
+            try:
+                successor = self._await_ready(self._fork(detection_model))
+            except Exception as e:
+                print(f"Could not start a replacement inference worker: {e}")
+                time.sleep(1.0)
+                continue
+            with self._lock:
+                current = None if self._closed else self._queues.get(detection_model)
+            if current is queue:
+                queue.put(successor)
+                if worn_out:
+                    with self._lock:
+                        self.recycled += 1
+            else:
+                self._retire(successor, timeout=1.0)
+            break
+        worker.state = "retiring"
+        # an idle old worker is taken out of the queue now; one in flight is retired when checked back in
+        if queue is not None:
+            with queue.mutex:
+                try:
+                    queue.queue.remove(worker)
+                except ValueError:
+                    worker = None
+            if worker is not None:
+                self._retire(worker)
+
+    def _queue_for(self, detection_model):
+        with self._lock:
+            queue = self._queues.get(detection_model)
+            stale = []
+            if detection_model is self._latest:
+                # the swap has been published: the previous model's workers can go after the grace period
+                stale = [m for m in self._queues if m is not detection_model and id(m) not in self._superseded]
+                self._superseded.update(id(m) for m in stale)
+        for old in stale:
+            self._background(self._drain, old)
+        if queue is None:
+            if self._latest is not None and detection_model is not self._latest:
+                raise RuntimeError("inference workers for these weights were retired after a swap")
+            # a model that was never prepared (e.g. registered without the warm-up hook)
+            self.prepare(detection_model)
+            with self._lock:
+                queue = self._queues[detection_model]
+        return queue
+
+    def _drain(self, detection_model):
+        time.sleep(self.swap_grace)
+        with self._lock:
+            queue = self._queues.pop(detection_model, None)
+            self._superseded.discard(id(detection_model))
+        # workers still in flight are retired when they are checked back in
+        while queue is not None and not queue.empty():
+            self._retire(queue.get_nowait())
+
+    def _checkout(self, queue):
+        while True:
+            worker = queue.get()
+            if worker.state == "retiring":
+                self._background(self._retire, worker)
+                continue
+            if not worker.process.is_alive():
+                with self._lock:
+                    self.crashed += 1
+                self._retire(worker, timeout=0)
+                worker.state = "replacing"
+                self._background(self._replace, worker)
+                continue
+            return worker
+
+    def _checkin(self, worker, queue):
+        with self._lock:
+            registered = not self._closed and self._queues.get(worker.detection_model) is queue
+        if not registered or worker.state == "retiring":
+            self._background(self._retire, worker)
+            return
+        if worker.frames >= self.max_frames and worker.state == "serving":
+            worker.state = "replacing"
+            self._background(self._replace, worker, True)
+        queue.put(worker)
+
+    def __call__(self, detection_model, images):
+        from multiprocessing import shared_memory
+
+        queue = self._queue_for(detection_model)
+        worker = self._checkout(queue)
+        try:
+            images = [np.ascontiguousarray(image, dtype=np.uint8) for image in images]
+            shm = shared_memory.SharedMemory(create=True, size=max(1, sum(image.nbytes for image in images)))
+            try:
+                offset = 0
+                for image in images:
+                    shm.buf[offset:offset + image.nbytes] = image.reshape(-1).data
+                    offset += image.nbytes
+                try:
+                    worker.conn.send((shm.name, [image.shape for image in images]))
+                    status, payload = worker.conn.recv()
+                except (EOFError, BrokenPipeError, OSError):
+                    with self._lock:
+                        self.crashed += 1
+                    self._retire(worker, timeout=0)
+                    worker.state = "replacing"
+                    self._background(self._replace, worker)
+                    worker = None
+                    raise RuntimeError("inference worker exited")
+            finally:
+                shm.close()
+                shm.unlink()
+            if status != "ok":
+                raise RuntimeError(f"inference worker failed: {payload}")
+            worker.frames += len(images)
+            with self._lock:
+                self.frames += len(images)
+            return [PooledResult(PooledBoxes(*arrays)) for arrays in payload]
+        finally:
+            if worker is not None:
+                self._checkin(worker, queue)
+
+    def stats(self):
+        with self._lock:
+            return {"workers": self.size, "idle": sum(q.qsize() for q in self._queues.values()), "models": len(self._queues),
+                    "frames": self.frames, "max_frames_per_worker": self.max_frames, "spawned": self.spawned,
+                    "recycled": self.recycled, "crashed": self.crashed}
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            queues = list(self._queues.values())
+            self._queues.clear()
+        for queue in queues:
+            while not queue.empty():
+                self._retire(queue.get_nowait(), timeout=1.0)
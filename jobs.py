@@ -0,0 +1,160 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from queue import Queue, Full
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+DROPPED = "dropped"
+
+class Job:
+    __slots__ = ("id", "key", "state", "stage", "payload", "result", "error", "created_at", "updated_at", "timings")
+
+    def __init__(self, key, payload):
+        self.id = uuid.uuid4().hex[:16]
+        self.key = key
+        self.state = QUEUED
+        self.stage = None
+        self.payload = payload
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.timings = {}
+
+    def describe(self):
+        return {"id": self.id, "key": self.key, "state": self.state, "stage": self.stage, "result": self.result,
+                "error": self.error, "created_at": self.created_at, "updated_at": self.updated_at,
+                "timings": {stage: round(seconds, 4) for stage, seconds in self.timings.items()}}
+
+class StagedPipeline:
+    # jobs pass through named stages, each with its own bounded queue and worker threads; a stage
+    # function takes the job, and anything it returns becomes job.result. A full downstream queue blocks
+    # the upstream workers, so only the first queue ever rejects work.
+    def __init__(self, stages, queue_size=16, max_jobs=1024, on_finish=None):
+        # stages: [(name, fn, workers), ...]; on_finish(job) is called once a job is done, failed or dropped
+        self.on_finish = on_finish
+        self.names = [name for name, _, _ in stages]
+        self.queues = [Queue(maxsize=queue_size) for _ in stages]
+        self.jobs = OrderedDict()
+        self.max_jobs = max_jobs
+        self.counts = {state: 0 for state in (DONE, FAILED, DROPPED)}
+        self.accepted = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self.threads = []
+        for index, (name, fn, workers) in enumerate(stages):
+            for n in range(workers):
+                thread = threading.Thread(target=self._worker, args=(index, fn), daemon=True, name=f"{name}-{n}")
+                thread.start()
+                self.threads.append(thread)
+
+    def submit(self, key, payload):
+        # returns the queued Job, or None when the first stage is full
+        job = Job(key, payload)
+        job.stage = self.names[0]
+        with self._lock:
+            self.jobs[job.id] = job
+            while len(self.jobs) > self.max_jobs:
+                self.jobs.popitem(last=False)
+        try:
+            self.queues[0].put_nowait(job)
+        except Full:
+            with self._lock:
+                self.jobs.pop(job.id, None)
+                self.rejected += 1
+            return None
+        with self._lock:
+            self.accepted += 1
+        return job
+
+    def drop(self, job):
+        # only a job still waiting for the first stage can be dropped; returns whether it was
+        with self._lock:
+            if job.state != QUEUED or job.stage != self.names[0]:
+                return False
+            self._finish(job, DROPPED)
+        self._notify(job)
+        return True
+
+    def get(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def _notify(self, job):
+        if self.on_finish is not None:
+            try:
+                self.on_finish(job)
+            except Exception as e:
+                print(f"Job {job.id} finish callback failed: {e}")
+
+    def _finish(self, job, state, error=None):
+        job.state = state
+        job.error = error
+        job.updated_at = time.time()
+        job.payload = None
+        self.counts[state] += 1
+
+    def _worker(self, index, fn):
+        queue = self.queues[index]
+        last = index == len(self.queues) - 1
+        while True:
+            job = queue.get()
+            if job is None:
+                queue.put(None)
+                break
+            with self._lock:
+                if job.state != QUEUED:
+                    continue
+                job.state = RUNNING
+                job.updated_at = time.time()
+            started = time.perf_counter()
+            try:
+                result = fn(job)
+                if result is not None:
+                    job.result = result
+            except Exception as e:
+                print(f"Job {job.id} failed in {self.names[index]}: {e}")
+                with self._lock:
+                    self._finish(job, FAILED, str(e))
+                self._notify(job)
+                continue
+            finally:
+                job.timings[self.names[index]] = time.perf_counter() - started
+            if last:
+                with self._lock:
+                    self._finish(job, DONE)
+                self._notify(job)
+                continue
+            with self._lock:
+                job.state = QUEUED
+                job.stage = self.names[index + 1]
+                job.updated_at = time.time()
+            self.queues[index + 1].put(job)
+
+    def stats(self):
+        with self._lock:
+            in_flight = {}
+            for job in self.jobs.values():
+                if job.state in (QUEUED, RUNNING):
+                    in_flight[job.stage] = in_flight.get(job.stage, 0) + 1
+        return {
+            "stages": self.names,
+            "queue_depth": dict(zip(self.names, (q.qsize() for q in self.queues))),
+            "in_flight": in_flight,
+            "accepted": self.accepted,
+            "done": self.counts[DONE],
+            "failed": self.counts[FAILED],
+            "dropped": self.counts[DROPPED],
+            "rejected": self.rejected,
+        }
+
+    def close(self):
+        for queue in self.queues:
+            try:
+                queue.put_nowait(None)
+            except Full:
+                pass
@@ -0,0 +1,89 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+LABEL_CACHE_FILE = "label_cache.db"
+
+def normalize_label(label):
+    return "_".join(label.strip().lower().replace("_", " ").split())
+
+class LabelCache:
+    def __init__(self, db_file=LABEL_CACHE_FILE, max_memory=256, ttl=30*24*3600, max_rows=5000):
+        self.db_file = db_file
+        self.max_memory = max_memory
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self._memory = OrderedDict()  # label -> (category, stored_at)
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._conn = sqlite3.connect(db_file, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS label_categories (label TEXT PRIMARY KEY, category TEXT NOT NULL, stored_at REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_label_categories_stored_at ON label_categories (stored_at)")
+        self._conn.commit()
+        self.evict()
+
+    def _remember(self, label, category, stored_at):
+        self._memory[label] = (category, stored_at)
+        self._memory.move_to_end(label)
+        while len(self._memory) > self.max_memory:
+            self._memory.popitem(last=False)
+
+    def get_many(self, labels):
+        # returns ({label: category} for cached labels, [labels still to classify])
+        now = time.time()
+        found = {}
+        missing = []
+        with self._lock:
+            for label in labels:
+                entry = self._memory.get(label)
+                if entry and now - entry[1] < self.ttl:
+                    self._memory.move_to_end(label)
+                    found[label] = entry[0]
+                    self.memory_hits += 1
+                    continue
+                row = self._conn.execute("SELECT category, stored_at FROM label_categories WHERE label = ? AND stored_at > ?",
+                                         (label, now - self.ttl)).fetchone()
+                if row:
+                    self._remember(label, row[0], row[1])
+                    found[label] = row[0]
+                    self.disk_hits += 1
+                else:
+                    missing.append(label)
+                    self.misses += 1
+        return found, missing
+
+    def put_many(self, categories):
+        if not categories:
+            return
+        now = time.time()
+        with self._lock:
+            for label, category in categories.items():
+                self._remember(label, category, now)
+            self._conn.executemany("INSERT OR REPLACE INTO label_categories (label, category, stored_at) VALUES (?, ?, ?)",
+                                   [(label, category, now) for label, category in categories.items()])
+            self._conn.commit()
+        self.evict()
+
+    def evict(self):
+        # drop expired rows, then the oldest rows beyond max_rows
+        with self._lock:
+            self._conn.execute("DELETE FROM label_categories WHERE stored_at <= ?", (time.time() - self.ttl,))
+            self._conn.execute("""DELETE FROM label_categories WHERE label NOT IN
+                                  (SELECT label FROM label_categories ORDER BY stored_at DESC LIMIT ?)""", (self.max_rows,))
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT COUNT(*) FROM label_categories").fetchone()[0]
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_entries": rows,
+            }
@@ -0,0 +1,151 @@
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+
+def is_status_message(message):
+    # "<item>:<category>[;warning]" is the bin's current status and only the newest one matters;
+    # "user... disposal_..." results are all delivered in order
+    return not message.startswith("user")
+
+class DeviceLink:
+    def __init__(self, station_id, url, queue_size):
+        self.station_id = station_id
+        self.url = url
+        self.queue_size = queue_size
+        self.pending = deque()
+        self.wakeup = asyncio.Event()
+        self.connected = False
+        self.sent = 0
+        self.merged = 0
+        self.dropped = 0
+        self.reconnects = 0
+        self.task = None
+
+    def enqueue(self, message):
+        if is_status_message(message):
+            stale = [m for m in self.pending if is_status_message(m)]
+            for m in stale:
+                self.pending.remove(m)
+            self.merged += len(stale)
+        self.pending.append(message)
+        while len(self.pending) > self.queue_size:
+            self.pending.popleft()
+            self.dropped += 1
+        self.wakeup.set()
+
+    def stats(self):
+        return {"url": self.url, "connected": self.connected, "pending": len(self.pending), "sent": self.sent,
+                "merged": self.merged, "dropped": self.dropped, "reconnects": self.reconnects}
+
+class LedHub:
+    # one asyncio loop (in a background thread) holding a connection per LED controller, keyed by station
+    def __init__(self, devices, queue_size=8, backoff_initial=0.5, backoff_max=30.0, metrics=None):
+        self.devices = dict(devices)
+        self.metrics = metrics
+        self.queue_size = queue_size
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.links = {}
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, daemon=True, name="led-hub")
+        self.thread.start()
+        for station_id in self.devices:
+            self.loop.call_soon_threadsafe(self._link, station_id)
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+        self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+        self.loop.close()
+
+    def add_device(self, station_id, url):
+        self.devices[station_id] = url
+        self.loop.call_soon_threadsafe(self._link, station_id)
+
+    def _link(self, station_id):
+        link = self.links.get(station_id)
+        if link is None and station_id in self.devices:
+            link = DeviceLink(station_id, self.devices[station_id], self.queue_size)
+            link.task = self.loop.create_task(self._maintain(link))
+            self.links[station_id] = link
+        return link
+
+    def send(self, station_id, message):
+        # thread-safe; messages for stations without a configured controller are dropped
+        self.loop.call_soon_threadsafe(self._enqueue, station_id, message)
+
+    def _enqueue(self, station_id, message):
+        link = self._link(station_id)
+        if link is None:
+            print(f"No LED controller configured for station {station_id}, dropped: {message}")
+            return
+        link.enqueue(message)
+
+    async def _maintain(self, link):
+        import websockets
+
+        backoff = self.backoff_initial
+        while True:
+            try:
+                async with websockets.connect(link.url, open_timeout=5) as ws:
+                    link.connected = True
+                    backoff = self.backoff_initial
+                    print(f"Connected to LED controller {link.station_id} at {link.url}")
+                    while True:
+                        while not link.pending:
+                            link.wakeup.clear()
+                            await link.wakeup.wait()
+                        message = link.pending.popleft()
+                        started = time.perf_counter()
+                        try:
+                            await ws.send(message)
+                        except BaseException:
+                            link.pending.appendleft(message)
+                            raise
+                        link.sent += 1
+                        if self.metrics is not None:
+                            self.metrics.observe("ws_send", time.perf_counter() - started)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"LED controller {link.station_id} disconnected: {e}")
+            link.connected = False
+            link.reconnects += 1
+            await asyncio.sleep(backoff * (0.5 + random.random() / 2))
+            backoff = min(backoff * 2, self.backoff_max)
+
+    def stats(self):
+        future = asyncio.run_coroutine_threadsafe(self._stats(), self.loop)
+        return future.result(timeout=2)
+
+    async def _stats(self):
+        return {station_id: link.stats() for station_id, link in self.links.items()}
+
+    def close(self, timeout=5.0):
+        # cancels the connection tasks and waits for them to unwind (closing their sockets) before the
+        # loop stops; safe to call more than once
+        async def shutdown():
+            tasks = [link.task for link in self.links.values() if link.task is not None]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        if not self.thread.is_alive():
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(shutdown(), self.loop).result(timeout)
+        except Exception as e:
+            print(f"LED hub did not shut down cleanly: {e}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout)
+
+def parse_devices(spec):
+    # "station1=ws://10.0.0.5:81/,station2=ws://10.0.0.6:81/"
+    devices = {}
+    for part in (spec or "").split(","):
+        if "=" in part:
+            station_id, url = part.split("=", 1)
+            devices[station_id.strip()] = url.strip()
+    return devices
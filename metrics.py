@@ -0,0 +1,214 @@
+import bisect
+import functools
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Histogram:
+    # fixed buckets (upper bounds, seconds); quantiles are reported as the upper bound of the bucket they fall in
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q):
+        with self._lock:
+            counts, count = list(self.counts), self.count
+        if not count:
+            return None
+        target = q * count
+        seen = 0
+        for i, c in enumerate(counts):
+            seen += c
+            if seen >= target:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def snapshot(self):
+        with self._lock:
+            counts, count, total = list(self.counts), self.count, self.sum
+        labels = [f"le_{b}" for b in self.buckets] + ["le_inf"]
+        return {
+            "count": count,
+            "mean": round(total / count, 4) if count else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": dict(zip(labels, counts)),
+        }
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+class _NullCounter:
+    value = 0
+
+    def inc(self, amount=1):
+        pass
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_COUNTER = _NullCounter()
+NULL_STAGE = _NullStage()
+
+class _Stage:
+    __slots__ = ("metrics", "name", "started")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.started)
+        return False
+
+class _Trace:
+    __slots__ = ("local", "trace_id", "previous")
+
+    def __init__(self, local, trace_id):
+        self.local = local
+        self.trace_id = trace_id
+
+    def __enter__(self):
+        self.previous = getattr(self.local, "trace_id", None)
+        self.local.trace_id = self.trace_id
+        return self
+
+    def __exit__(self, *exc):
+        self.local.trace_id = self.previous
+        return False
+
+class Metrics:
+    # per-stage histograms (seconds), counters and recent traces, rendered as Prometheus text.
+    # A disabled instance hands out shared no-op objects and leaves decorated functions unwrapped.
+    def __init__(self, enabled=True, prefix="waste", buckets=DEFAULT_BUCKETS, max_traces=256):
+        self.enabled = enabled
+        self.prefix = prefix
+        self.buckets = tuple(buckets)
+        self.max_traces = max_traces
+        self.stages = {}
+        self.counters = {}
+        self.help = {}
+        self.traces = OrderedDict()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def new_trace(self):
+        return uuid.uuid4().hex[:16] if self.enabled else None
+
+    def trace(self, trace_id):
+        # stages observed on this thread inside the block are recorded under trace_id
+        if not self.enabled or trace_id is None:
+            return NULL_STAGE
+        return _Trace(self._local, trace_id)
+
+    def current_trace(self):
+        return getattr(self._local, "trace_id", None)
+
+    def stage(self, name):
+        return _Stage(self, name) if self.enabled else NULL_STAGE
+
+    def timed(self, name):
+        def decorate(fn):
+            if not self.enabled:
+                return fn
+
+            @functools.wraps(fn)
+            def timed(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.observe(name, time.perf_counter() - started)
+            return timed
+        return decorate
+
+    def observe(self, name, seconds, trace_id=None):
+        if not self.enabled:
+            return
+        histogram = self.stages.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.stages.setdefault(name, Histogram(self.buckets))
+        histogram.observe(seconds)
+        trace_id = trace_id or self.current_trace()
+        if trace_id is not None:
+            with self._lock:
+                spans = self.traces.get(trace_id)
+                if spans is None:
+                    spans = self.traces[trace_id] = []
+                    while len(self.traces) > self.max_traces:
+                        self.traces.popitem(last=False)
+                spans.append({"stage": name, "seconds": round(seconds, 6), "at": round(time.time(), 3)})
+
+    def counter(self, name, help="", **labels):
+        if not self.enabled:
+            return NULL_COUNTER
+        key = (name, tuple(sorted(labels.items())))
+        counter = self.counters.get(key)
+        if counter is None:
+            with self._lock:
+                counter = self.counters.setdefault(key, Counter())
+                if help:
+                    self.help.setdefault(name, help)
+        return counter
+
+    def spans(self, trace_id):
+        with self._lock:
+            return list(self.traces.get(trace_id, ()))
+
+    def render(self):
+        if not self.enabled:
+            return "# metrics disabled\n"
+        stage_metric = f"{self.prefix}_stage_seconds"
+        lines = [f"# HELP {stage_metric} Time spent in each pipeline stage.", f"# TYPE {stage_metric} histogram"]
+        with self._lock:
+            stages = sorted(self.stages.items())
+            counters = sorted(self.counters.items())
+        for name, histogram in stages:
+            with histogram._lock:
+                counts, count, total = list(histogram.counts), histogram.count, histogram.sum
+            cumulative = 0
+            for bound, c in zip(histogram.buckets + (float("inf"),), counts):
+                cumulative += c
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{stage_metric}_bucket{{stage="{name}",le="{le}"}} {cumulative}')
+            lines.append(f'{stage_metric}_sum{{stage="{name}"}} {total}')
+            lines.append(f'{stage_metric}_count{{stage="{name}"}} {count}')
+        described = set()
+        for (name, labels), counter in counters:
+            metric = f"{self.prefix}_{name}_total"
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {metric} {self.help.get(name, name)}")
+                lines.append(f"# TYPE {metric} counter")
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+            lines.append(f"{metric}{{{label_text}}} {counter.value}" if label_text else f"{metric} {counter.value}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,118 @@
+import threading
+import time
+
+class ModelEntry:
+    __slots__ = ("name", "loader", "warmup", "value", "state", "error", "load_seconds",
+                 "warmup_seconds", "loaded_at", "swaps", "ready", "lock")
+
+    def __init__(self, name, loader, warmup):
+        self.name = name
+        self.loader = loader
+        self.warmup = warmup
+        self.value = None
+        self.state = "registered"  # registered -> loading -> ready | failed
+        self.error = None
+        self.load_seconds = None
+        self.warmup_seconds = None
+        self.loaded_at = None
+        self.swaps = 0
+        self.ready = threading.Event()
+        self.lock = threading.Lock()
+
+class ModelRegistry:
+    def __init__(self):
+        self._entries = {}
+
+    def register(self, name, loader, warmup=None):
+        # loader() returns the model; warmup(model) runs a synthetic pass before it is served
+        self._entries[name] = ModelEntry(name, loader, warmup)
+
+    def _build(self, entry, loader):
+        started = time.perf_counter()
+        value = loader()
+        loaded = time.perf_counter()
+        if entry.warmup is not None:
+            entry.warmup(value)
+        warmed = time.perf_counter()
+        return value, loaded - started, warmed - loaded
+
+    def _load(self, entry):
+        try:
+            value, load_seconds, warmup_seconds = self._build(entry, entry.loader)
+        except Exception as e:
+            print(f"Error loading model {entry.name}: {e}")
+            with entry.lock:
+                entry.state = "failed"
+                entry.error = str(e)
+            entry.ready.set()
+            return
+        with entry.lock:
+            entry.value = value
+            entry.state = "ready"
+            entry.error = None
+            entry.load_seconds = load_seconds
+            entry.warmup_seconds = warmup_seconds
+            entry.loaded_at = time.time()
+        entry.ready.set()
+        print(f"Model {entry.name} ready (load {load_seconds:.2f}s, warm-up {warmup_seconds:.2f}s)")
+
+    def start(self, *names):
+        # load the named models (all of them by default) in background threads
+        for name in names or list(self._entries):
+            entry = self._entries[name]
+            with entry.lock:
+                if entry.state != "registered":
+                    continue
+                entry.state = "loading"
+            threading.Thread(target=self._load, args=(entry,), daemon=True, name=f"load-{name}").start()
+
+    def get(self, name, timeout=None):
+        entry = self._entries[name]
+        if entry.state == "registered":
+            self.start(name)
+        if not entry.ready.wait(timeout):
+            raise RuntimeError(f"Model {name} is still loading")
+        if entry.value is None:
+            raise RuntimeError(f"Model {name} failed to load: {entry.error}")
+        return entry.value
+
+    def is_ready(self, name=None):
+        names = [name] if name else list(self._entries)
+        return all(self._entries[n].value is not None for n in names)
+
+    def swap(self, name, loader=None):
+        # builds and warms the replacement while the current model keeps serving, then switches the reference
+        entry = self._entries[name]
+        loader = loader or entry.loader
+        try:
+            value, load_seconds, warmup_seconds = self._build(entry, loader)
+        except Exception as e:
+            with entry.lock:
+                entry.error = f"swap failed: {e}"
+            raise
+        with entry.lock:
+            entry.value = value
+            entry.loader = loader
+            entry.state = "ready"
+            entry.error = None
+            entry.load_seconds = load_seconds
+            entry.warmup_seconds = warmup_seconds
+            entry.loaded_at = time.time()
+            entry.swaps += 1
+        entry.ready.set()
+        print(f"Model {name} swapped (load {load_seconds:.2f}s, warm-up {warmup_seconds:.2f}s)")
+        return value
+
+    def status(self):
+        result = {}
+        for name, entry in self._entries.items():
+            with entry.lock:
+                result[name] = {
+                    "state": entry.state,
+                    "error": entry.error,
+                    "load_seconds": round(entry.load_seconds, 3) if entry.load_seconds is not None else None,
+                    "warmup_seconds": round(entry.warmup_seconds, 3) if entry.warmup_seconds is not None else None,
+                    "loaded_at": entry.loaded_at,
+                    "swaps": entry.swaps,
+                }
+        return result
@@ -0,0 +1,154 @@
+import base64
+import json
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+class RemoteUnavailable(Exception):
+    pass
+
+class CircuitBreaker:
+    # closed -> open after `failure_threshold` consecutive failures; one trial call is let through after `reset_timeout`
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+class DirectTransport:
+    # the real services; clients are looked up lazily so importing this module stays cheap
+    def __init__(self, get_vision_client=None, openai_api_key=None):
+        self.get_vision_client = get_vision_client
+        self.openai_api_key = openai_api_key
+
+    def __call__(self, service, payload, timeout):
+        if service == "chat":
+            import openai
+            if self.openai_api_key:
+                openai.api_key = self.openai_api_key
+            response = openai.ChatCompletion.create(request_timeout=timeout, **payload)
+            return response.choices[0].message.content.strip()
+        if service == "vision":
+            from google.cloud import vision
+            image = vision.Image(content=payload["content"])
+            response = self.get_vision_client().label_detection(image=image, timeout=timeout)
+            if response.error.message:
+                raise RuntimeError(response.error.message)
+            return [{"description": l.description, "score": round(l.score * 100, 2)} for l in response.label_annotations]
+        raise ValueError(f"Unknown service {service}")
+
+class HttpTransport:
+    # POSTs {"payload": ...} to <base_url>/<service> and returns the "result" field; used with local stub servers
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+
+    def __call__(self, service, payload, timeout):
+        if "content" in payload:
+            payload = dict(payload, content=base64.b64encode(payload["content"]).decode())
+        body = json.dumps({"payload": payload}).encode()
+        req = urllib.request.Request(f"{self.base_url}/{service}", data=body, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return json.loads(resp.read())["result"]
+
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="remote")
+
+class RemoteService:
+    def __init__(self, name, service, transport, deadline, hedge_after=None, breaker=None):
+        self.name = name
+        self.service = service
+        self.transport = transport
+        self.deadline = deadline
+        self.hedge_after = hedge_after
+        self.breaker = breaker or CircuitBreaker()
+        self.calls = 0
+        self.failures = 0
+        self.fallbacks = 0
+        self.hedges = 0
+
+    def call(self, payload, fallback=None):
+        # returns the first successful result within the deadline, otherwise fallback(); raises RemoteUnavailable without one
+        self.calls += 1
+        if not self.breaker.allow():
+            return self._fallback(fallback, f"{self.name} circuit open")
+        started = time.monotonic()
+        deadline = started + self.deadline
+        pending = {_executor.submit(self.transport, self.service, payload, self.deadline)}
+        hedged = self.hedge_after is None
+        error = None
+        while pending:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            wake = deadline if hedged else min(deadline, started + self.hedge_after)
+            done, pending = wait(pending, timeout=wake - now, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    self.breaker.record_success()
+                    return future.result()
+                error = future.exception()
+            if not hedged and (not pending or time.monotonic() >= started + self.hedge_after):
+                # a hedge is sent when the first attempt is slow, or as an immediate retry when it failed
+                hedged = True
+                self.hedges += 1
+                remaining = max(0.0, deadline - time.monotonic())
+                pending.add(_executor.submit(self.transport, self.service, payload, remaining))
+        for future in pending:
+            future.cancel()
+        self.failures += 1
+        self.breaker.record_failure()
+        reason = f"{self.name} failed: {error}" if error else f"{self.name} timed out after {self.deadline}s"
+        return self._fallback(fallback, reason)
+
+    def _fallback(self, fallback, reason):
+        print(reason)
+        self.fallbacks += 1
+        if fallback is None:
+            raise RemoteUnavailable(reason)
+        return fallback()
+
+    def stats(self):
+        return {
+            "state": self.breaker.state,
+            "deadline_s": self.deadline,
+            "hedge_after_s": self.hedge_after,
+            "calls": self.calls,
+            "failures": self.failures,
+            "fallbacks": self.fallbacks,
+            "hedges": self.hedges,
+        }
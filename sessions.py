@@ -0,0 +1,90 @@
+import threading
+
+from Smart_waste_classification.ultrasonic import SensorStateMachine
+
+DEFAULT_STATION = "default"
+
+class StationSession:
+    __slots__ = ("station_id", "lock", "is_running", "last_image", "last_result", "last_text",
+                 "last_waste_text", "user_identity", "reminder_items", "is_recording", "stop_requested",
+                 "last_close_status", "waiting_for_close_event", "has_received_image",
+                 "last_item_disposed", "last_item_class", "version", "image_version",
+                 "preview_jpegs", "changed", "sensor", "trace_id", "pending_job")
+
+    def __init__(self, station_id):
+        self.station_id = station_id
+        self.lock = threading.RLock()
+        self.is_running = False
+        self.user_identity = None
+        self.reminder_items = set()
+        self.is_recording = False
+        self.stop_requested = False
+        self.last_close_status = None
+        self.sensor = SensorStateMachine()
+        # set per disposal by start_detection when metrics are enabled
+        self.trace_id = None
+        # separate from `lock` so watchers are not held up while an image is being processed
+        self.changed = threading.Condition()
+        self.version = 0
+        self.image_version = 0
+        self.preview_jpegs = (None, None)
+        self.reset()
+
+    def reset(self):
+        # clear everything tied to one disposal, keep the last ultrasonic reading
+        self.last_image = None
+        self.last_result = None
+        self.last_text = None
+        self.last_waste_text = None
+        self.waiting_for_close_event = False
+        self.has_received_image = False
+        # the asynchronous /image job for this disposal, until its notify stage runs
+        self.pending_job = None
+        self.last_item_disposed = None
+        self.last_item_class = None
+
+    def publish(self, previews=None):
+        # bump the version after a visible change; previews are the (input, result) JPEGs shown in the UI
+        with self.changed:
+            self.version += 1
+            if previews is not None:
+                self.preview_jpegs = previews
+                self.image_version = self.version
+            self.changed.notify_all()
+
+    def wait_for_change(self, since, timeout):
+        with self.changed:
+            self.changed.wait_for(lambda: self.version != since, timeout)
+            return self.version
+
+class SessionRegistry:
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get(self, station_id=None):
+        # creates the session on first use; only start and sensor/camera ingest paths should call this
+        station_id = station_id or DEFAULT_STATION
+        session = self._sessions.get(station_id)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(station_id)
+                if session is None:
+                    session = StationSession(station_id)
+                    self._sessions[station_id] = session
+        return session
+
+    def find(self, station_id=None):
+        # read paths use this so that polling an unknown station id does not create a session for it
+        return self._sessions.get(station_id or DEFAULT_STATION)
+
+    def station_ids(self):
+        with self._lock:
+            return sorted(self._sessions)
+
+    def __len__(self):
+        return len(self._sessions)
+
+def station_from_request(req):
+    # ESP32 boards identify themselves with ?station=<id> or an X-Station-Id header
+    return req.args.get("station") or req.headers.get("X-Station-Id") or DEFAULT_STATION
@@ -0,0 +1,123 @@
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+SPEAKER_INDEX_FILE = "speaker_index.npy"
+EMBEDDING_DIM = 38
+
+def _mel_filterbank(n_fft, sample_rate, n_mels):
+    def hz_to_mel(hz):
+        return 2595 * np.log10(1 + hz / 700)
+    mels = np.linspace(hz_to_mel(60), hz_to_mel(sample_rate / 2), n_mels + 2)
+    bins = np.floor((n_fft + 1) * (700 * (10 ** (mels / 2595) - 1)) / sample_rate).astype(int)
+    bank = np.zeros((n_mels, n_fft // 2 + 1), dtype=np.float32)
+    for m in range(1, n_mels + 1):
+        left, center, right = bins[m - 1], bins[m], bins[m + 1]
+        if center > left:
+            bank[m - 1, left:center] = (np.arange(left, center) - left) / (center - left)
+        if right > center:
+            bank[m - 1, center:right] = (right - np.arange(center, right)) / (right - center)
+    return bank
+
+_N_FFT = 512
+_MEL_BANK = _mel_filterbank(_N_FFT, 16000, 40)
+_DCT = np.cos(np.pi / 40 * (np.arange(40) + 0.5)[None, :] * np.arange(20)[:, None]).astype(np.float32)
+
+def mfcc_embedding(audio, sample_rate=16000):
+    # mean and spread of MFCCs 1-19 over the voiced frames, L2-normalised; audio is float32 mono at 16 kHz
+    frame, hop = int(0.025 * sample_rate), int(0.010 * sample_rate)
+    if len(audio) < frame:
+        return None
+    count = 1 + (len(audio) - frame) // hop
+    frames = np.lib.stride_tricks.as_strided(audio, (count, frame), (audio.strides[0] * hop, audio.strides[0]))
+    frames = frames * np.hamming(frame).astype(np.float32)
+    energy = (frames * frames).mean(axis=1)
+    voiced = frames[energy > max(1e-6, 0.1 * np.median(energy))]
+    if len(voiced) < 10:
+        return None
+    power = np.abs(np.fft.rfft(voiced, _N_FFT)) ** 2
+    log_mel = np.log(power @ _MEL_BANK.T + 1e-10)
+    mfcc = log_mel @ _DCT.T
+    embedding = np.concatenate((mfcc[:, 1:].mean(axis=0), mfcc[:, 1:].std(axis=0))).astype(np.float32)
+    return embedding / (np.linalg.norm(embedding) or 1.0)
+
+class SpeakerIndex:
+    # nearest-neighbour lookup over enrolled voices; the matrix is memory-mapped from SPEAKER_INDEX_FILE
+    def __init__(self, repository, index_file=SPEAKER_INDEX_FILE, embed=mfcc_embedding, dim=EMBEDDING_DIM):
+        self.repository = repository
+        self.index_file = index_file
+        self.names_file = os.path.splitext(index_file)[0] + ".json"
+        self.embed = embed
+        self.dim = dim
+        self._lock = threading.Lock()
+        self.names = []
+        self.matrix = np.zeros((0, dim), dtype=np.float32)
+        self.load()
+
+    def load(self):
+        # reuse the memory-mapped matrix on disk if it matches the database, rebuild it otherwise
+        rows = self.repository.get_speaker_embeddings()
+        stamp = [[name, updated_at] for name, _, _, updated_at in rows]
+        try:
+            with open(self.names_file) as f:
+                saved = json.load(f)
+            if saved == stamp and os.path.exists(self.index_file):
+                matrix = np.load(self.index_file, mmap_mode="r")
+                if matrix.shape == (len(rows), self.dim):
+                    with self._lock:
+                        self.names = [name for name, _ in stamp]
+                        self.matrix = matrix
+                    return
+        except (OSError, ValueError):
+            pass
+        self._rebuild(rows)
+
+    def _rebuild(self, rows):
+        matrix = np.zeros((len(rows), self.dim), dtype=np.float32)
+        for i, (_, blob, _, _) in enumerate(rows):
+            matrix[i] = np.frombuffer(blob, dtype=np.float32)
+        tmp = self.index_file + ".tmp.npy"
+        np.save(tmp, matrix)
+        os.replace(tmp, self.index_file)
+        with open(self.names_file, "w") as f:
+            json.dump([[name, updated_at] for name, _, _, updated_at in rows], f)
+        with self._lock:
+            self.names = [name for name, _, _, _ in rows]
+            self.matrix = np.load(self.index_file, mmap_mode="r") if len(rows) else matrix
+
+    def enroll(self, name, audio):
+        # running average with any earlier enrollment of the same user
+        embedding = self.embed(audio)
+        if embedding is None:
+            return False
+        samples = 1
+        for row_name, blob, row_samples, _ in self.repository.get_speaker_embeddings():
+            if row_name == name:
+                old = np.frombuffer(blob, dtype=np.float32)
+                embedding = old * row_samples + embedding
+                embedding /= np.linalg.norm(embedding) or 1.0
+                samples = row_samples + 1
+                break
+        self.repository.save_speaker_embedding(name, embedding.astype(np.float32).tobytes(), samples, time.time())
+        self._rebuild(self.repository.get_speaker_embeddings())
+        return True
+
+    def match(self, audio):
+        # (name, similarity, margin over the next-best speaker), or (None, 0.0, 0.0); with a single enrolled
+        # speaker there is nothing to compare against and the margin is 0.0
+        embedding = self.embed(audio)
+        with self._lock:
+            names, matrix = self.names, self.matrix
+        if embedding is None or not names:
+            return None, 0.0, 0.0
+        scores = np.asarray(matrix) @ embedding
+        order = np.argsort(scores)[::-1]
+        best = float(scores[order[0]])
+        runner_up = float(scores[order[1]]) if len(order) > 1 else best
+        return names[order[0]], best, best - runner_up
+
+    def __len__(self):
+        return len(self.names)
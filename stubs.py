@@ -0,0 +1,153 @@
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# deterministic stand-ins for OpenAI and Google Vision, spoken to through remote.HttpTransport
+RECYCLABLE = {"bottle", "can", "paper", "cardboard", "glass", "plastic", "tin", "carton", "newspaper", "box"}
+
+def stub_chat(payload):
+    system = payload["messages"][0]["content"]
+    prompt = payload["messages"][-1]["content"]
+    if "identity" in system:
+        transcript = prompt.rsplit("Speech content:", 1)[-1]
+        lines = []
+        name = re.search(r"name is ([A-Za-z]+(?: [A-Za-z]+)?)", transcript)
+        if name:
+            lines.append(f"Name: {name.group(1)}")
+        digits = re.search(r"\d+", transcript)
+        if digits:
+            lines.append(f"ID: {digits.group(0)}")
+        return "\n".join(lines) or "Unknown"
+    items = [i.strip() for i in prompt.strip().split("\n")[-1].split(",") if i.strip()]
+    return "\n".join(f"{item} - {'Recyclable Waste' if any(w in item.lower() for w in RECYCLABLE) else 'Non-Recyclable Waste'}"
+                     for item in items)
+
+def stub_vision(payload):
+    return [{"description": "Bottle", "score": 91.5}, {"description": "Plastic", "score": 80.2}]
+
+class StubServer:
+    def __init__(self, latency=None, host="127.0.0.1", port=0):
+        # latency: {"chat": seconds, "vision": seconds}
+        self.latency = dict(latency or {})
+        self.requests = {"chat": 0, "vision": 0}
+        handlers = {"chat": stub_chat, "vision": stub_vision}
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                service = self.path.strip("/")
+                if service not in handlers:
+                    self.send_error(404)
+                    return
+                payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))["payload"]
+                stub.requests[service] += 1
+                time.sleep(stub.latency.get(service, 0))
+                body = json.dumps({"result": handlers[service](payload)}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class FakeLedServer:
+    # stands in for an ESP8266 LED controller: accepts WebSocket connections and records every text message
+    def __init__(self, host="127.0.0.1", port=0):
+        import asyncio
+
+        self.host = host
+        self.port = port
+        self.messages = []
+        self.connections = set()
+        self.loop = asyncio.new_event_loop()
+        self._server = None
+        self.error = None
+        self._ready = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        import asyncio
+        import websockets
+
+        async def handler(ws, *args):
+            self.connections.add(ws)
+            try:
+                async for message in ws:
+                    self.messages.append(message)
+            except websockets.ConnectionClosed:
+                pass
+            finally:
+                self.connections.discard(ws)
+
+        async def serve():
+            # websockets 14+ needs a running loop to construct the server, so it is built inside a coroutine
+            return await websockets.serve(handler, self.host, self.port)
+
+        asyncio.set_event_loop(self.loop)
+        try:
+            self._server = self.loop.run_until_complete(serve())
+            self.port = self._server.sockets[0].getsockname()[1]
+        except Exception as e:
+            self.error = e
+            return
+        finally:
+            self._ready.set()
+        self.loop.run_forever()
+
+    @property
+    def url(self):
+        return f"ws://{self.host}:{self.port}/"
+
+    def start(self):
+        self.thread.start()
+        if not self._ready.wait(5):
+            raise RuntimeError("Fake LED server did not start within 5s")
+        if self.error is not None:
+            raise RuntimeError(f"Fake LED server failed to start: {self.error}")
+        return self
+
+    def drop_connections(self):
+        # simulates a controller reboot so reconnect behaviour can be checked
+        import asyncio
+        for ws in list(self.connections):
+            asyncio.run_coroutine_threadsafe(ws.close(), self.loop)
+
+    def stop(self):
+        # safe to call when start() failed
+        import asyncio
+
+        async def shutdown():
+            self._server.close()
+            await self._server.wait_closed()
+
+        if self._server is not None and self.loop.is_running():
+            try:
+                asyncio.run_coroutine_threadsafe(shutdown(), self.loop).result(5)
+            except Exception as e:
+                print(f"Fake LED server did not shut down cleanly: {e}")
+        if self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+
+if __name__ == "__main__":
+    import sys
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    stub = StubServer(port=port).start()
+    print(f"Stub OpenAI/Vision server on {stub.url}; start the server with REMOTE_STUB_URL={stub.url}")
+    stub.thread.join()
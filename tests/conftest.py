@@ -0,0 +1,12 @@
+import os
+import sys
+import types
+
+# the modules import each other as Smart_waste_classification.*; make that work from a plain checkout
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+try:
+    import Smart_waste_classification  # noqa: F401
+except ImportError:
+    package = types.ModuleType("Smart_waste_classification")
+    package.__path__ = [ROOT]
+    sys.modules["Smart_waste_classification"] = package
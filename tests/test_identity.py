@@ -0,0 +1,42 @@
+import pytest
+
+from Smart_waste_classification.identity import IdentityResolver, extract_name_runs
+
+# IDENTITY_MATCH_THRESHOLD in api.py: below it the transcript goes to GPT-4 and create_user
+THRESHOLD = 0.75
+# SPEAKER_ENROLL_CONFIDENCE in server.py
+ENROLL_CONFIDENCE = 0.9
+
+@pytest.fixture
+def resolver():
+    return IdentityResolver([("alice", 42), ("john smith", 1001), ("bob", 5)])
+
+@pytest.mark.parametrize("transcript", [
+    "my name is john doe my id is 1001",
+    "joe smith one zero zero one",
+    "my name is bob jones",
+    "my name is bob my id is 42",
+    "my name is kevin id 1001",
+])
+def test_other_people_are_not_matched_locally(resolver, transcript):
+    match = resolver.resolve(transcript)
+    assert match.confidence < THRESHOLD
+
+def test_extra_name_words_block_enrollment(resolver):
+    assert resolver.resolve("my name is bob jones").confidence < ENROLL_CONFIDENCE
+
+@pytest.mark.parametrize("transcript, name", [
+    ("my name is john smith my id is 1001", "john smith"),
+    ("john smith", "john smith"),
+    ("hi this is bob", "bob"),
+    ("my name is Bob, ID 5", "bob"),
+    ("my id is four two", "alice"),
+])
+def test_known_users_are_matched(resolver, transcript, name):
+    match = resolver.resolve(transcript)
+    assert match.name == name
+    assert match.confidence >= THRESHOLD
+
+def test_name_runs_stop_at_filler_and_digits():
+    assert extract_name_runs("my name is bob jones, my id is 42") == ["bob jones"]
+    assert extract_name_runs("joe smith one zero zero one") == ["joe smith"]
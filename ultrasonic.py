@@ -0,0 +1,34 @@
+import threading
+
+CLOSE = "close"
+RELEASE = "release"
+
+class SensorStateMachine:
+    # per-station ultrasonic status: only transitions produce events, and a repeated close of the
+    # same bin within `debounce` seconds of the last one is ignored
+    __slots__ = ("debounce", "last_status", "last_ts", "last_close_status", "last_close_ts", "lock")
+
+    def __init__(self, debounce=3.0):
+        self.debounce = debounce
+        self.last_status = 0
+        self.last_ts = None
+        self.last_close_status = None
+        self.last_close_ts = None
+        self.lock = threading.Lock()
+
+    def feed(self, status, ts):
+        # returns CLOSE, RELEASE or None
+        if status == self.last_status:
+            return None
+        with self.lock:
+            if status == self.last_status or (self.last_ts is not None and ts < self.last_ts):
+                return None
+            self.last_status = status
+            self.last_ts = ts
+            if status not in (1, 2):
+                return RELEASE
+            if status == self.last_close_status and ts - self.last_close_ts < self.debounce:
+                return None
+            self.last_close_status = status
+            self.last_close_ts = ts
+            return CLOSE
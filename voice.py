@@ -0,0 +1,188 @@
+import threading
+import time
+
+import numpy as np
+
+WHISPER_SAMPLE_RATE = 16000
+
+class RingBuffer:
+    def __init__(self, capacity):
+        self.data = np.zeros(capacity, dtype=np.float32)
+        self.capacity = capacity
+        self.written = 0  # total samples ever written
+
+    def write(self, samples):
+        n = len(samples)
+        if n >= self.capacity:
+            self.data[:] = samples[-self.capacity:]
+            self.written += n
+            return
+        start = self.written % self.capacity
+        end = start + n
+        if end <= self.capacity:
+            self.data[start:end] = samples
+        else:
+            split = self.capacity - start
+            self.data[start:] = samples[:split]
+            self.data[:end - self.capacity] = samples[split:]
+        self.written += n
+
+    def read(self, start, end):
+        # samples [start, end) in absolute positions, clipped to what is still in the buffer
+        start = max(start, self.written - self.capacity, 0)
+        end = min(end, self.written)
+        if end <= start:
+            return np.zeros(0, dtype=np.float32)
+        idx = np.arange(start, end) % self.capacity
+        return self.data[idx]
+
+class EnergyVAD:
+    # RMS energy detector with an adaptive noise floor; frames are fed in order
+    def __init__(self, sample_rate, frame_ms=30, min_rms=0.01, ratio=3.0, start_frames=3):
+        self.frame = int(sample_rate * frame_ms / 1000)
+        self.min_rms = min_rms
+        self.ratio = ratio
+        self.start_frames = start_frames
+        self.noise = None
+        self.run = 0
+
+    def is_speech(self, frame):
+        rms = float(np.sqrt(np.mean(frame * frame))) if len(frame) else 0.0
+        if self.noise is None:
+            self.noise = rms
+        speech = rms > max(self.min_rms, self.noise * self.ratio)
+        if not speech:
+            self.noise = 0.95 * self.noise + 0.05 * rms
+        self.run = self.run + 1 if speech else 0
+        return self.run >= self.start_frames
+
+def resample(audio, rate, target=WHISPER_SAMPLE_RATE):
+    if rate == target or len(audio) == 0:
+        return audio.astype(np.float32, copy=False)
+    duration = len(audio) / rate
+    n = int(round(duration * target))
+    # average over each output interval first so the interpolation does not alias
+    window = max(1, int(rate / target))
+    if window > 1:
+        audio = np.convolve(audio, np.ones(window, dtype=np.float32) / window, mode="same")
+    positions = np.arange(n) * (rate / target)
+    return np.interp(positions, np.arange(len(audio)), audio).astype(np.float32)
+
+class VoiceCapture:
+    # captures one utterance, ending once the speaker has been silent for silence_timeout seconds
+    def __init__(self, max_duration=5.0, silence_timeout=0.8, preroll=0.3, **vad_kwargs):
+        self.max_duration = max_duration
+        self.silence_timeout = silence_timeout
+        self.preroll_seconds = preroll
+        self.vad_kwargs = vad_kwargs
+        self.sample_rate = None
+        self.buffer = None
+        self.vad = None
+        self.done = threading.Event()
+        self.reason = None
+        self.speech_start = None
+        self.last_speech = None
+        self.started_at = None
+        self._pending = np.zeros(0, dtype=np.float32)
+        self._stream = None
+        self._thread = None
+
+    def _prepare(self, sample_rate):
+        self.sample_rate = sample_rate
+        self.preroll = int(self.preroll_seconds * sample_rate)
+        self.buffer = RingBuffer(int(self.max_duration * sample_rate))
+        self.vad = EnergyVAD(sample_rate, **self.vad_kwargs)
+
+    def _feed(self, block):
+        if self.done.is_set():
+            return
+        block = np.asarray(block, dtype=np.float32)
+        if block.ndim > 1:
+            block = block.mean(axis=1)
+        self.buffer.write(block)
+        frames = np.concatenate((self._pending, block))
+        frame = self.vad.frame
+        usable = len(frames) - len(frames) % frame
+        position = self.buffer.written - len(frames)
+        for offset in range(0, usable, frame):
+            if self.vad.is_speech(frames[offset:offset + frame]):
+                if self.speech_start is None:
+                    self.speech_start = position + offset - (self.vad.start_frames - 1) * frame
+                self.last_speech = position + offset + frame
+        self._pending = frames[usable:]
+
+        if self.last_speech is not None and self.buffer.written - self.last_speech >= self.silence_timeout * self.sample_rate:
+            self._finish("silence")
+        elif self.buffer.written >= self.max_duration * self.sample_rate:
+            self._finish("max_duration")
+
+    def _finish(self, reason):
+        if not self.done.is_set():
+            self.reason = reason
+            self.done.set()
+
+    def start_microphone(self, sample_rate, channels=1):
+        import sounddevice as sd
+
+        self._prepare(sample_rate)
+
+        def callback(indata, frames, time_info, status):
+            if status:
+                print(f"Audio input status: {status}")
+            self._feed(indata.copy())
+
+        self.started_at = time.time()
+        self._stream = sd.InputStream(samplerate=self.sample_rate, channels=channels, dtype="float32", callback=callback)
+        self._stream.start()
+        return self
+
+    def start_wav(self, path, realtime=False, block_ms=50):
+        # replays a WAV file through the same path as the microphone, for machines without one
+        import soundfile as sf
+
+        self._prepare(sf.info(path).samplerate)
+
+        def worker():
+            blocksize = int(self.sample_rate * block_ms / 1000)
+            for block in sf.blocks(path, blocksize=blocksize, dtype="float32", always_2d=True):
+                if self.done.is_set():
+                    break
+                self._feed(block)
+                if realtime:
+                    time.sleep(block_ms / 1000)
+            self._finish("end_of_file")
+
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=worker, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, reason="stopped"):
+        self._finish(reason)
+        if self._stream is not None:
+            self._stream.stop()
+            self._stream.close()
+            self._stream = None
+
+    def wait(self, timeout=None):
+        return self.done.wait(timeout)
+
+    def elapsed(self):
+        return self.buffer.written / self.sample_rate if self.buffer is not None else 0.0
+
+    def speech_seconds(self):
+        if self.speech_start is None:
+            return 0.0
+        return (self.buffer.written - self.speech_start) / self.sample_rate
+
+    def audio(self):
+        # float32 mono at 16 kHz, trimmed to the detected utterance; ready for whisper_model.transcribe
+        if self.speech_start is None:
+            start, end = 0, self.buffer.written
+        else:
+            start = self.speech_start - self.preroll
+            end = min(self.buffer.written, self.last_speech + int(0.2 * self.sample_rate))
+        return resample(self.buffer.read(start, end), self.sample_rate)
+
+    def raw_audio(self):
+        return self.buffer.read(0, self.buffer.written)